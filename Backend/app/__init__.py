@@ -3,18 +3,24 @@ from flask_cors import CORS
 import os
 import logging
 from app.utils.logger import setup_logger
-from app.routes.auth import auth_bp
-from app.routes.user import user_bp
-from app.routes.admin import admin_bp
-from app.routes.tasks import tasks_bp
-from app.routes.recognition import recognition_bp
+from app.utils.uploads import StreamingRequest
 
 def create_app():
+    # 蓝图在此处导入, 使脚本可以单独导入 app.services 而不连接数据库
+    from app.routes.auth import auth_bp
+    from app.routes.user import user_bp
+    from app.routes.admin import admin_bp
+    from app.routes.tasks import tasks_bp
+    from app.routes.recognition import recognition_bp
+    
     # 配置日志
     setup_logger()
     
     app = Flask(__name__)
     
+    # 视频上传在解析请求时直接写入磁盘
+    app.request_class = StreamingRequest
+    
     # 启用 CORS
     CORS(app)
     
@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from app.database import fetch_one, fetch_all, execute_sql
 from app.utils.auth import require_auth
 from app.services.auth_service import log_admin_action
+from app.services.image_service import result_cache
 import logging
 
 admin_bp = Blueprint('admin', __name__)
@@ -459,3 +460,28 @@ def get_all_user_logs(admin_info):
     except Exception as e:
         logging.error(f"Get all user logs failed: {str(e)}")
         return jsonify({'success': False, 'message': f'获取日志失败: {str(e)}'}), 500
+
+@admin_bp.route('/cache/stats', methods=['GET'])
+@require_auth('admin')
+def get_cache_stats(admin_info):
+    """Admin get inference result cache statistics"""
+    if result_cache is None:
+        return jsonify({'success': True, 'data': {'enabled': False}})
+    
+    return jsonify({
+        'success': True,
+        'data': dict(result_cache.stats(), enabled=True)
+    })
+
+@admin_bp.route('/cache/clear', methods=['POST'])
+@require_auth('admin')
+def clear_cache(admin_info):
+    """Admin clear inference result cache"""
+    try:
+        if result_cache is not None:
+            result_cache.clear()
+        log_admin_action(admin_info['id'], f"管理员{admin_info['id']}清空推理结果缓存")
+        return jsonify({'success': True, 'message': '缓存已清空'})
+    except Exception as e:
+        logging.error(f"Clear cache failed: {str(e)}")
+        return jsonify({'success': False, 'message': f'清空缓存失败: {str(e)}'}), 500
@@ -1,17 +1,31 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, send_file
 from PIL import Image
 import io
 import uuid
 import threading
 import time
 import logging
+import json
 from app.utils.common import allowed_file, is_video_file
-from app.utils.auth import require_auth
+from app.utils.auth import require_auth, verify_token
+from app.utils.uploads import SpooledUpload, discard_upload
 from app.services.auth_service import update_user_limit, log_user_action
-from app.services.image_service import process_image, process_images_batch, process_image_realtime, process_video_with_annotation
+from app.services.image_service import process_image, process_images_batch, process_image_realtime, process_video_with_annotation, artifact_store
+from app.services.artifact_store import ARTIFACT_CONFIG
 from app.services.task_service import register_task, unregister_task, update_task_progress, is_task_cancelled
+from app.services.tiling import parse_tiling_options
+from app.services.pipeline import parse_output_options
+from app.services.keyframes import KEYFRAME_MODES
+from app.services.realtime import (REALTIME_CONFIG, RealtimeSession, parse_frame_message,
+                                   http_states)
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
 
 recognition_bp = Blueprint('recognition', __name__)
+sock = Sock() if Sock is not None else None
 
 @recognition_bp.route('/predict', methods=['POST'])
 @require_auth('user')
@@ -37,7 +51,13 @@ def predict(user_info):
             return jsonify({'success': False, 'message': '不支持的文件格式，请上传JPG、PNG、BMP格式的图片'}), 400
         
         try:
-            image = Image.open(io.BytesIO(file.read()))
+            tiling = parse_tiling_options(request.form)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        try:
+            image_data = file.read()
+            image = Image.open(io.BytesIO(image_data))
         except Exception as e:
             return jsonify({'success': False, 'message': f'无法读取图片文件: {str(e)}'}), 400
         
@@ -46,7 +66,8 @@ def predict(user_info):
         
         logging.info(f"User {user_info['username']} uploaded image: {file.filename}, size: {image.size}")
         
-        result = process_image(image)
+        columnar = request.form.get('format') == 'columnar'
+        result = process_image(image, image_data=image_data, tiling=tiling, columnar=columnar)
         
         remaining_limit = -1
         if user_info['imagelimit'] != -1:
@@ -62,7 +83,7 @@ def predict(user_info):
             log_user_action(user_info['id'], 1, 1, -1)
             logging.info(f"User {user_info['username']} (unlimited) image recognition completed")
         
-        logging.info(f"Recognition success, detected {result['detected_objects']} objects, time {result.get('inference_time_ms', 0):.2f}ms")
+        logging.info(f"Recognition success, detected {result['detected_objects']} objects, time {result.get('inference_time_ms', 0):.2f}ms, queue wait {result.get('queue_wait_ms', 0):.2f}ms")
         
         return jsonify({
             'success': True,
@@ -102,18 +123,46 @@ def batch_predict(user_info):
             unregister_task(task_id)
             return jsonify({'success': False, 'message': '最多只能处理100个文件'}), 400
         
+        try:
+            tiling = parse_tiling_options(request.form)
+            return_annotated, output = parse_output_options(request.form)
+        except ValueError as e:
+            unregister_task(task_id)
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        keyframe_mode = request.form.get('keyframe_mode') or None
+        if keyframe_mode is not None and keyframe_mode not in KEYFRAME_MODES:
+            unregister_task(task_id)
+            return jsonify({'success': False, 'message': '关键帧模式仅支持 adaptive、fixed'}), 400
+        
         file_data_cache = {}
+        video_uploads = {}
+        upload_hashes = {}
+        upload_sizes = {}
         total_size_bytes = 0
         
+        def release_uploads():
+            for path in video_uploads.values():
+                discard_upload(path)
+        
         logging.info(f"User {user_info['username']} caching {len(files)} files...")
         for i, file in enumerate(files):
             try:
-                file.seek(0)
-                data = file.read()
-                file_data_cache[file.filename] = data
-                total_size_bytes += len(data)
+                if isinstance(file.stream, SpooledUpload):
+                    # Videos were written to disk while the request was parsed; keep the path only
+                    video_uploads[file.filename] = file.stream.retain()
+                    upload_hashes[file.filename] = file.stream.hexdigest()
+                    upload_sizes[file.filename] = file.stream.size
+                    logging.info(f"Spooled video {file.filename}: {file.stream.size} bytes, sha256 {upload_hashes[file.filename]}")
+                else:
+                    file.seek(0)
+                    data = file.read()
+                    file_data_cache[file.filename] = data
+                    upload_sizes[file.filename] = len(data)
+                total_size_bytes += upload_sizes[file.filename]
             except Exception as e:
                 logging.error(f"Cache file {file.filename} failed: {str(e)}")
+                release_uploads()
                 unregister_task(task_id)
                 return jsonify({'success': False, 'message': f'读取文件失败: {str(e)}'}), 400
         
@@ -123,11 +172,13 @@ def batch_predict(user_info):
         logging.info(f"Cache complete, total size: {total_size_mb:.3f} MB, required quota: {required_quota:.3f} MB")
         
         if total_size_bytes > 100 * 1024 * 1024:
+            release_uploads()
             unregister_task(task_id)
             return jsonify({'success': False, 'message': '文件总大小不能超过100MB'}), 400
         
         if user_info['batchlimit'] != -1:
             if user_info['batchlimit'] < required_quota:
+                release_uploads()
                 unregister_task(task_id)
                 return jsonify({
                     'success': False, 
@@ -137,8 +188,6 @@ def batch_predict(user_info):
                     'remaining_quota': round(user_info['batchlimit'], 3)
                 }), 403
         
-        update_task_progress(task_id, total_files=len(files), stage='processing')
-        
         def process_files_background():
             results = []
             actual_quota_used = round(required_quota, 3)
@@ -172,6 +221,7 @@ def batch_predict(user_info):
                     
                     try:
                         images = []
+                        valid_image_data = []
                         valid_image_filenames = []
                         
                         for i, file in enumerate(image_files):
@@ -202,6 +252,7 @@ def batch_predict(user_info):
                                     image = image.convert('RGB')
                                 
                                 images.append(image)
+                                valid_image_data.append(image_data)
                                 valid_image_filenames.append(file.filename)
                                 
                             except Exception as e:
@@ -209,44 +260,42 @@ def batch_predict(user_info):
                                 results.append({'filename': file.filename, 'success': False, 'error': f'Read failed: {str(e)}'})
                         
                         if images:
-                            batch_size = 8
-                            total_batches = (len(images) + batch_size - 1) // batch_size
+                            total_files = len(image_files) + len(video_files)
+                            done_before = len(results)
                             
-                            for batch_idx in range(total_batches):
-                                if is_task_cancelled(task_id):
-                                    logging.info(f"Task {task_id} cancelled")
-                                    update_task_progress(task_id, stage='cancelled')
-                                    return
-                                
-                                start_idx = batch_idx * batch_size
-                                end_idx = min(start_idx + batch_size, len(images))
-                                batch_images = images[start_idx:end_idx]
-                                batch_filenames = valid_image_filenames[start_idx:end_idx]
-                                
-                                batch_results = process_images_batch(batch_images, return_annotated=True, batch_size=batch_size)
-                                
-                                for i, (result, filename) in enumerate(zip(batch_results, batch_filenames)):
-                                    if 'error' in result:
-                                        results.append({'filename': filename, 'success': False, 'error': result['error']})
-                                    else:
-                                        results.append({
-                                            'filename': filename,
-                                            'success': True,
-                                            'file_type': 'image',
-                                            'data': result,
-                                            'detected_objects': result['detected_objects'],
-                                            'inference_time_ms': result.get('inference_time_ms', 0)
-                                        })
-                                    
-                                    current_index = len(results)
-                                    total_files = len(image_files) + len(video_files)
-                                    overall_progress = (current_index / total_files) * 100 if total_files > 0 else 0
-                                    
-                                    update_task_progress(task_id, 
-                                                       current_file_index=current_index,
-                                                       current_file_name=filename,
-                                                       current_file_progress=100,
-                                                       overall_progress=overall_progress)
+                            def image_progress(done, total):
+                                current_index = done_before + done
+                                update_task_progress(task_id,
+                                                   current_file_index=current_index,
+                                                   current_file_name=valid_image_filenames[done - 1],
+                                                   current_file_progress=100,
+                                                   overall_progress=(current_index / total_files) * 100)
+                            
+                            # One call for all images so encoding overlaps the next batch's inference
+                            batch_results = process_images_batch(images, return_annotated=return_annotated,
+                                                                 batch_size=8,
+                                                                 image_data_list=valid_image_data,
+                                                                 tiling=tiling, output=output,
+                                                                 task_checker=lambda: is_task_cancelled(task_id),
+                                                                 progress_callback=image_progress)
+                            
+                            if is_task_cancelled(task_id):
+                                logging.info(f"Task {task_id} cancelled")
+                                update_task_progress(task_id, stage='cancelled')
+                                return
+                            
+                            for result, filename in zip(batch_results, valid_image_filenames):
+                                if 'error' in result:
+                                    results.append({'filename': filename, 'success': False, 'error': result['error']})
+                                else:
+                                    results.append({
+                                        'filename': filename,
+                                        'success': True,
+                                        'file_type': 'image',
+                                        'data': result,
+                                        'detected_objects': result['detected_objects'],
+                                        'inference_time_ms': result.get('inference_time_ms', 0)
+                                    })
                     
                     except Exception as e:
                         logging.error(f"Batch image processing failed: {str(e)}")
@@ -277,15 +326,13 @@ def batch_predict(user_info):
                     try:
                         logging.info(f"Processing video: {file.filename}")
                         
-                        video_data = file_data_cache.get(file.filename)
-                        if not video_data:
+                        video_path = video_uploads.get(file.filename)
+                        if not video_path:
                             results.append({'filename': file.filename, 'success': False, 'error': 'Missing file data'})
                             current_completed = len(results)
                             overall_progress = (current_completed / total_files) * 100 if total_files > 0 else 0
                             update_task_progress(task_id, current_file_index=current_completed, current_file_name=file.filename, current_file_progress=100, overall_progress=overall_progress)
                             continue
-                            
-                        video_file = io.BytesIO(video_data)
                         
                         def progress_callback(current_frame, total_frames):
                             if total_frames > 0:
@@ -298,16 +345,18 @@ def batch_predict(user_info):
                                 update_task_progress(task_id, current_file_progress=progress_percent, overall_progress=overall_progress)
                         
                         result = process_video_with_annotation(
-                            video_file, 
+                            video_path,
                             frame_interval=1,
                             task_checker=lambda: is_task_cancelled(task_id),
-                            progress_callback=progress_callback
+                            progress_callback=progress_callback,
+                            keyframe_mode=keyframe_mode
                         )
                         
                         results.append({
                             'filename': file.filename,
                             'success': True,
                             'file_type': 'video',
+                            'upload_sha256': upload_hashes.get(file.filename),
                             'data': result,
                             'detected_objects': result['detected_objects'],
                             'processing_time_ms': result['processing_time_ms']
@@ -335,8 +384,8 @@ def batch_predict(user_info):
                 if successful_results:
                     for result in successful_results:
                         filename = result['filename']
-                        if filename in file_data_cache:
-                            file_size_mb = len(file_data_cache[filename]) / (1024 * 1024)
+                        if filename in upload_sizes:
+                            file_size_mb = upload_sizes[filename] / (1024 * 1024)
                             quota_used += file_size_mb
                 
                 update_task_progress(task_id, 
@@ -360,8 +409,18 @@ def batch_predict(user_info):
             except Exception as e:
                 logging.error(f"Batch processing failed: {str(e)}")
                 update_task_progress(task_id, stage='error', error=str(e))
+            finally:
+                release_uploads()
         
-        threading.Thread(target=process_files_background, daemon=True).start()
+        try:
+            update_task_progress(task_id, total_files=len(files), stage='processing')
+            threading.Thread(target=process_files_background, daemon=True).start()
+        except Exception as e:
+            # The background thread only owns the spooled videos once it is running
+            logging.error(f"Batch processing start failed: {str(e)}")
+            release_uploads()
+            unregister_task(task_id)
+            return jsonify({'success': False, 'message': f'批量处理失败: {str(e)}'}), 500
         
         if user_info['batchlimit'] == -1:
             remaining_quota = -1
@@ -383,6 +442,25 @@ def batch_predict(user_info):
             'message': f'批量处理失败: {str(e)}'
         }), 500
 
+@recognition_bp.route('/artifacts/<name>', methods=['GET'])
+def download_artifact(name):
+    """下载标注结果文件 (支持 Range 与 ETag)"""
+    resolved = artifact_store.resolve(name) if artifact_store is not None else None
+    if resolved is None:
+        return jsonify({'success': False, 'message': '文件不存在或已过期'}), 404
+    
+    path, mimetype = resolved
+    # 文件写入后不再修改, 文件名即可作为 ETag
+    return send_file(
+        path,
+        mimetype=mimetype,
+        conditional=True,
+        etag=name.split('.')[0],
+        max_age=ARTIFACT_CONFIG['ttl_seconds'],
+        as_attachment=request.args.get('download') == '1',
+        download_name=name
+    )
+
 @recognition_bp.route('/realtime/detect', methods=['POST'])
 @require_auth('user')
 def realtime_detect_fast(user_info):
@@ -403,39 +481,25 @@ def realtime_detect_fast(user_info):
         
         try:
             image_data = file.read()
-            image = Image.open(io.BytesIO(image_data))
-            
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-                
+            # Header check only; the worker decodes at reduced size (JPEG draft mode)
+            Image.open(io.BytesIO(image_data))
         except Exception as e:
             return jsonify({'success': False, 'message': f'无法读取图片: {str(e)}'}), 400
         
-        result = process_image_realtime(image)
-        
-        predictions = result.get('predictions', [])
-        formatted_predictions = {}
-        
-        for i, pred in enumerate(predictions):
-            formatted_predictions[i] = {
-                'asset_category': pred.get('asset_category', pred.get('class_name_zh', '')),
-                'defect_status': pred.get('defect_status', '正常'),
-                'confidence': round(pred.get('confidence', 0), 3),
-                'center': {
-                    'x': round(pred.get('center', {}).get('x', 0), 4),
-                    'y': round(pred.get('center', {}).get('y', 0), 4)
-                },
-                'width': round(pred.get('width', 0), 4),
-                'height': round(pred.get('height', 0), 4)
-            }
+        # Per-stream state: near-duplicate frames reuse the last result, tracked boxes their classification.
+        # stream_id separates cameras/tabs of one user; clients without it share one state per user
+        stream_id = request.form.get('stream_id', '')
+        if len(stream_id) > REALTIME_CONFIG['max_stream_id_length']:
+            return jsonify({'success': False, 'message': 'stream_id 过长'}), 400
+        state = http_states.get((user_info['id'], stream_id))
+        result = state.predict(image_data, process_image_realtime)
         
+        # encoding=delta opts in to compact responses (changes since the previous frame), resync=1 forces a keyframe
+        encoding = request.form.get('encoding')
         return jsonify({
             'success': True,
-            'data': {
-                'predictions': formatted_predictions,
-                'inference_time_ms': round(result.get('inference_time_ms', 0), 1),
-                'detected_objects': len(predictions)
-            }
+            'encoding': encoding if encoding == 'delta' else 'full',
+            'data': state.encode(result, encoding, resync=request.form.get('resync') == '1')
         })
             
     except Exception as e:
@@ -448,6 +512,97 @@ def realtime_detect_fast(user_info):
             }
         })
 
+def _authenticate_ws(ws, send):
+    """Wait for the first message {"type": "auth", "token": ...}; returns user_info or None"""
+    message = ws.receive(timeout=REALTIME_CONFIG['auth_timeout_s'])
+    try:
+        data = json.loads(message) if isinstance(message, str) else None
+    except ValueError:
+        data = None
+    
+    token = data.get('token') if isinstance(data, dict) and data.get('type') == 'auth' else None
+    if token and token.startswith('Bearer '):
+        token = token[7:]
+    
+    user_info = verify_token(token, 'user')
+    if not user_info:
+        send({'type': 'error', 'error_type': 'auth_failed', 'message': '认证失败，请重新登录'})
+        return None
+    if user_info.get('isbannd', 0) == 1:
+        send({'type': 'error', 'error_type': 'banned', 'message': '您的账户已被封禁，请联系管理员'})
+        return None
+    if user_info['realtimePermission'] != 1:
+        send({'type': 'error', 'error_type': 'permission_denied', 'message': '您没有实时检测权限'})
+        return None
+    return user_info
+
+def realtime_ws(ws):
+    """实时检测 WebSocket 通道
+
+    The token is verified once per connection. Frames are binary messages (4-byte
+    frame id + JPEG); results come back as JSON tagged with the frame id. Frames
+    arriving while the previous one is still being inferred replace each other,
+    so only the newest is processed. {"type": "config", "encoding": "delta"}
+    switches to delta-encoded results, {"type": "resync"} requests a keyframe.
+    """
+    send_lock = threading.Lock()
+    
+    def send(message):
+        with send_lock:
+            ws.send(json.dumps(message, ensure_ascii=False))
+    
+    user_info = _authenticate_ws(ws, send)
+    if user_info is None:
+        return
+    
+    session = RealtimeSession(process_image_realtime, send).start()
+    send({'type': 'ready', 'max_frame_bytes': REALTIME_CONFIG['max_frame_bytes']})
+    logging.info(f"User {user_info['username']} realtime session opened")
+    
+    try:
+        while True:
+            message = ws.receive(timeout=1)
+            if message is None:
+                if session.idle_for() > REALTIME_CONFIG['idle_timeout_s']:
+                    send({'type': 'error', 'error_type': 'idle_timeout', 'message': '长时间未收到画面，连接已关闭'})
+                    break
+                continue
+            
+            if isinstance(message, str):
+                try:
+                    control = json.loads(message)
+                except ValueError:
+                    control = {}
+                if control.get('type') == 'close':
+                    break
+                if control.get('type') == 'ping':
+                    send({'type': 'pong'})
+                elif control.get('type') == 'config':
+                    session.set_encoding('delta' if control.get('encoding') == 'delta' else None)
+                elif control.get('type') == 'resync':
+                    session.request_resync()
+                continue
+            
+            try:
+                frame_id, image_data = parse_frame_message(message)
+            except ValueError as e:
+                send({'type': 'error', 'message': str(e)})
+                continue
+            session.submit(frame_id, image_data)
+    
+    except Exception as e:
+        logging.info(f"Realtime session of {user_info['username']} closed: {str(e)}")
+    finally:
+        session.close()
+        stats = session.stats()
+        logging.info(f"User {user_info['username']} realtime session ended, processed {stats['processed_frames']} frames, "
+                     f"dropped {stats['dropped_frames']}, reused {stats['reused_frames']}")
+
+if sock is not None:
+    realtime_ws = sock.route('/realtime/ws', bp=recognition_bp)(realtime_ws)
+else:
+    logging.warning("flask-sock not installed, realtime WebSocket endpoint /api/realtime/ws disabled")
+
 @recognition_bp.route('/realtime', methods=['POST'])
 @require_auth('user')
 def realtime_detect(user_info):
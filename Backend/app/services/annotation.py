@@ -0,0 +1,173 @@
+import os
+import shutil
+import subprocess
+import threading
+import numpy as np
+import cv2
+from PIL import Image, ImageDraw, ImageFont
+from app.services.postprocess import DEFAULT_SUB_RESULT
+
+# Annotation rendering
+# font_paths: extra fonts tried before the built-in candidates
+ANNOTATION_CONFIG = {
+    'font_size': 20,
+    'box_thickness': 3,
+    'font_paths': [],
+    'max_cached_labels': 4096
+}
+
+FONT_CANDIDATES = [
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simhei.ttf",
+    "C:/Windows/Fonts/simsun.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/usr/share/fonts/wqy-microhei/wqy-microhei.ttc",
+    "/usr/share/fonts/wqy-zenhei/wqy-zenhei.ttc",
+    "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
+    "/System/Library/Fonts/PingFang.ttc",
+]
+
+# RGB colors per defect status
+STATUS_COLORS = {
+    '正常': (0, 255, 0),
+    '缺陷': (255, 0, 0),
+    'default': (0, 255, 255)
+}
+
+def _fontconfig_cjk_font():
+    """Ask fontconfig for a font covering Chinese, if fc-match is installed"""
+    if not shutil.which('fc-match'):
+        return None
+    try:
+        path = subprocess.run(['fc-match', '-f', '%{file}', ':lang=zh'],
+                              capture_output=True, text=True, timeout=5).stdout.strip()
+    except Exception:
+        return None
+    return path if path and os.path.exists(path) else None
+
+def load_font(size, extra_paths=()):
+    """Load the first available CJK-capable font, falling back to PIL's default"""
+    candidates = list(extra_paths) + FONT_CANDIDATES
+    fc_path = _fontconfig_cjk_font()
+    if fc_path:
+        candidates.append(fc_path)
+
+    for font_path in candidates:
+        if os.path.exists(font_path):
+            try:
+                font = ImageFont.truetype(font_path, size)
+                print(f"标注字体: {font_path}")
+                return font
+            except Exception as e:
+                print(f"Load font {font_path} failed: {e}")
+
+    print("未找到中文字体, 使用默认字体")
+    return ImageFont.load_default()
+
+class AnnotationRenderer:
+    """Draws boxes and labels directly into HWC uint8 arrays.
+
+    The font is loaded once. Each distinct label (class, defect status and
+    confidence at the two decimals shown) is rendered to a small bitmap on first
+    use and pasted from the cache afterwards, so per-frame cost is a few array
+    copies and cv2.rectangle calls.
+    """
+    def __init__(self, font_size=20, box_thickness=3, font_paths=(), max_cached_labels=4096):
+        self.font = load_font(font_size, font_paths)
+        self.box_thickness = box_thickness
+        self.max_cached_labels = max_cached_labels
+        self.labels = {}
+        self.lock = threading.Lock()
+
+    def _render_label(self, text, status):
+        try:
+            left, top, right, bottom = self.font.getbbox(text)
+            text_width, text_height = right - left, bottom - top
+        except Exception:
+            text_width, text_height = 100, 20
+
+        color = STATUS_COLORS.get(status, STATUS_COLORS['default'])
+        text_color = (255, 255, 255) if status == '缺陷' else (0, 0, 0)
+        label = Image.new('RGB', (text_width + 11, text_height + 6), color)
+        ImageDraw.Draw(label).text((5, 2), text, fill=text_color, font=self.font)
+        rgb = np.asarray(label)
+        return {'RGB': rgb, 'BGR': np.ascontiguousarray(rgb[:, :, ::-1])}
+
+    def label_bitmap(self, class_name_zh, confidence, status, color_order='RGB'):
+        text = f"{class_name_zh} ({confidence:.2f})"
+        if status:
+            text += f" - {status}"
+
+        key = (text, status)
+        bitmaps = self.labels.get(key)
+        if bitmaps is None:
+            bitmaps = self._render_label(text, status)
+            with self.lock:
+                if len(self.labels) >= self.max_cached_labels:
+                    self.labels.clear()
+                self.labels[key] = bitmaps
+        return bitmaps[color_order]
+
+    def draw_box(self, frame, box, class_name_zh, confidence, status, color_order='RGB'):
+        height, width = frame.shape[:2]
+        x1, y1, x2, y2 = (int(v) for v in box)
+        color = STATUS_COLORS.get(status, STATUS_COLORS['default'])
+        if color_order == 'BGR':
+            color = color[::-1]
+
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, self.box_thickness)
+
+        label = self.label_bitmap(class_name_zh, confidence, status, color_order)
+        label_h, label_w = label.shape[:2]
+        label_y = y1 - label_h
+        if label_y < 0:
+            label_y = y2
+
+        # Paste the part of the label that falls inside the frame
+        fx1, fy1 = max(x1, 0), max(label_y, 0)
+        fx2, fy2 = min(x1 + label_w, width), min(label_y + label_h, height)
+        if fx2 > fx1 and fy2 > fy1:
+            frame[fy1:fy2, fx1:fx2] = label[fy1 - label_y:fy2 - label_y, fx1 - x1:fx2 - x1]
+
+    def draw(self, frame, predictions, color_order='RGB'):
+        """Draw prediction dicts onto frame in place"""
+        for pred in predictions:
+            try:
+                self.draw_box(frame, pred['bbox'], pred['class_name_zh'], pred['confidence'],
+                              pred.get('defect_status', '正常'), color_order)
+            except Exception as e:
+                print(f"Error drawing annotation: {e}")
+        return frame
+
+    def draw_detections(self, frame, detections, sub_results=None, color_order='RGB'):
+        """Draw columnar Detections onto frame in place without building prediction dicts"""
+        if len(detections) == 0:
+            return frame
+        _, names_zh = detections.class_names()
+        sub_results = sub_results or [DEFAULT_SUB_RESULT] * len(detections)
+        for box, name, conf, sub in zip(detections.xyxy.tolist(), names_zh.tolist(),
+                                        detections.conf.tolist(), sub_results):
+            try:
+                self.draw_box(frame, box, name, conf, sub['defect_status'], color_order)
+            except Exception as e:
+                print(f"Error drawing annotation: {e}")
+        return frame
+
+    def draw_pil(self, image, predictions):
+        """Annotated copy of a PIL image"""
+        frame = np.array(image.convert('RGB'))
+        self.draw(frame, predictions)
+        return Image.fromarray(frame)
+
+def create_renderer(config=None):
+    config = config or ANNOTATION_CONFIG
+    return AnnotationRenderer(
+        font_size=config['font_size'],
+        box_thickness=config['box_thickness'],
+        font_paths=config['font_paths'],
+        max_cached_labels=config['max_cached_labels']
+    )
@@ -0,0 +1,131 @@
+import mimetypes
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+# Annotated image/video outputs served by URL instead of base64 in JSON
+# root_dir: None disables the store and results fall back to data URLs
+ARTIFACT_CONFIG = {
+    'enabled': True,
+    'root_dir': 'artifacts',
+    'ttl_seconds': 24 * 3600,
+    'cleanup_interval_s': 600,
+    'url_prefix': '/api/artifacts'
+}
+
+# Types mimetypes may not know on older Pythons
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'webp': 'image/webp',
+    'mp4': 'video/mp4',
+    'npz': 'application/octet-stream',
+    'gz': 'application/gzip'
+}
+
+ARTIFACT_NAME = re.compile(r'^[0-9a-f]{32}\.[a-z0-9]{1,5}$')
+
+class ArtifactStore:
+    """Write-once files on local disk addressed by random names.
+
+    Names are 128-bit random ids, so an artifact URL works as a capability that
+    <img>/<video> tags can load without an Authorization header. Files older
+    than ttl_seconds are removed by a sweep that runs at most once per
+    cleanup_interval_s, triggered from writes. Pool processes share the same
+    directory, so artifacts written in any process are served by the API.
+    """
+    def __init__(self, root_dir, ttl_seconds=24 * 3600, cleanup_interval_s=600, url_prefix='/api/artifacts'):
+        self.root_dir = root_dir
+        self.ttl_seconds = ttl_seconds
+        self.cleanup_interval = cleanup_interval_s
+        self.url_prefix = url_prefix.rstrip('/')
+        self.lock = threading.Lock()
+        self.last_cleanup = 0
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _new_name(self, extension):
+        return f"{uuid.uuid4().hex}.{extension.lower().lstrip('.')}"
+
+    def url(self, name):
+        return f"{self.url_prefix}/{name}"
+
+    def put_bytes(self, data, extension):
+        """Store data and return its URL"""
+        name = self._new_name(extension)
+        path = os.path.join(self.root_dir, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._maybe_cleanup()
+        return self.url(name)
+
+    def put_file(self, src_path, extension):
+        """Move an existing file into the store and return its URL"""
+        name = self._new_name(extension)
+        shutil.move(src_path, os.path.join(self.root_dir, name))
+        self._maybe_cleanup()
+        return self.url(name)
+
+    def resolve(self, name):
+        """(path, mimetype) for a live artifact name, or None"""
+        if not ARTIFACT_NAME.match(name):
+            return None
+        path = os.path.join(self.root_dir, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if time.time() - mtime > self.ttl_seconds:
+            return None
+        extension = name.rsplit('.', 1)[1]
+        return path, CONTENT_TYPES.get(extension) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    def is_live_url(self, value):
+        """False for artifact URLs whose file is gone; other values are left alone"""
+        if not isinstance(value, str) or not value.startswith(self.url_prefix + '/'):
+            return True
+        return self.resolve(value[len(self.url_prefix) + 1:]) is not None
+
+    def result_is_live(self, result):
+        """Whether every artifact a (cached) result points to can still be served"""
+        return all(self.is_live_url(result.get(field)) for field in ('annotated_image', 'annotated_video'))
+
+    def _maybe_cleanup(self):
+        now = time.time()
+        with self.lock:
+            if now - self.last_cleanup < self.cleanup_interval:
+                return
+            self.last_cleanup = now
+        self.cleanup()
+
+    def cleanup(self):
+        """Remove artifacts (and stale temp files) older than the TTL"""
+        cutoff = time.time() - self.ttl_seconds
+        removed = 0
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            print(f"已清理 {removed} 个过期结果文件")
+        return removed
+
+def create_store(config=None):
+    """Build an ArtifactStore from config, or None when disabled"""
+    config = config or ARTIFACT_CONFIG
+    if not config['enabled'] or not config['root_dir']:
+        return None
+    return ArtifactStore(
+        config['root_dir'],
+        ttl_seconds=config['ttl_seconds'],
+        cleanup_interval_s=config['cleanup_interval_s'],
+        url_prefix=config['url_prefix']
+    )
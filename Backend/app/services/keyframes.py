@@ -0,0 +1,122 @@
+import numpy as np
+import cv2
+
+# Keyframe selection for video analysis
+# mode: 'adaptive' runs the detector on scene changes, 'fixed' every frame_interval frames
+# threshold: mean absolute difference (0-1) of the downscaled grayscale frame against
+#            the last keyframe; 'hist' method uses Bhattacharyya distance instead
+KEYFRAME_CONFIG = {
+    'mode': 'adaptive',
+    'method': 'diff',
+    'analysis_width': 64,
+    'threshold': 0.06,
+    'hist_threshold': 0.15,
+    'min_interval': 2,
+    'max_interval': 30
+}
+
+KEYFRAME_MODES = ('adaptive', 'fixed')
+
+class FixedIntervalSelector:
+    """Every interval-th frame is a keyframe"""
+    def __init__(self, interval=1):
+        self.interval = max(1, interval)
+        self.frames = 0
+        self.keyframes = 0
+
+    def is_keyframe(self, index, frame):
+        self.frames += 1
+        if index % self.interval == 0:
+            self.keyframes += 1
+            return True
+        return False
+
+    def stats(self):
+        return {
+            'keyframe_mode': 'fixed',
+            'analyzed_frames': self.frames,
+            'keyframes': self.keyframes,
+            'keyframe_ratio': round(self.keyframes / self.frames, 4) if self.frames else 0
+        }
+
+class AdaptiveKeyframeSelector:
+    """Marks a frame as keyframe when it differs enough from the last keyframe.
+
+    Frames are compared as small grayscale thumbnails against the last keyframe
+    rather than the previous frame, so slow pans accumulate change until they
+    cross the threshold. No two keyframes are closer than min_interval frames
+    and at least one is taken every max_interval frames.
+    """
+    def __init__(self, method='diff', analysis_width=64, threshold=0.06, hist_threshold=0.15,
+                 min_interval=2, max_interval=30):
+        self.method = method
+        self.analysis_width = analysis_width
+        self.threshold = threshold
+        self.hist_threshold = hist_threshold
+        self.min_interval = max(1, min_interval)
+        self.max_interval = max(self.min_interval, max_interval)
+        self.reference = None
+        self.last_index = None
+        self.frames = 0
+        self.keyframes = 0
+        self.forced = 0
+
+    def _signature(self, frame):
+        height, width = frame.shape[:2]
+        size = (self.analysis_width, max(1, int(height * self.analysis_width / width)))
+        small = cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        if self.method == 'hist':
+            hist = cv2.calcHist([small], [0], None, [32], [0, 256])
+            return cv2.normalize(hist, hist).flatten()
+        return small.astype(np.float32)
+
+    def _change(self, signature):
+        if self.method == 'hist':
+            return cv2.compareHist(self.reference, signature, cv2.HISTCMP_BHATTACHARYYA)
+        return float(np.mean(np.abs(signature - self.reference))) / 255
+
+    def is_keyframe(self, index, frame):
+        self.frames += 1
+
+        if self.last_index is not None:
+            since_last = index - self.last_index
+            if since_last < self.min_interval:
+                return False
+            signature = self._signature(frame)
+            if since_last < self.max_interval:
+                threshold = self.hist_threshold if self.method == 'hist' else self.threshold
+                if self._change(signature) < threshold:
+                    return False
+            else:
+                self.forced += 1
+        else:
+            signature = self._signature(frame)
+
+        self.reference = signature
+        self.last_index = index
+        self.keyframes += 1
+        return True
+
+    def stats(self):
+        return {
+            'keyframe_mode': 'adaptive',
+            'analyzed_frames': self.frames,
+            'keyframes': self.keyframes,
+            'forced_keyframes': self.forced,
+            'keyframe_ratio': round(self.keyframes / self.frames, 4) if self.frames else 0
+        }
+
+def create_selector(mode=None, frame_interval=1, config=None):
+    """Keyframe selector for one video; frame_interval only applies to fixed mode"""
+    config = config or KEYFRAME_CONFIG
+    mode = mode or config['mode']
+    if mode == 'fixed':
+        return FixedIntervalSelector(frame_interval)
+    return AdaptiveKeyframeSelector(
+        method=config['method'],
+        analysis_width=config['analysis_width'],
+        threshold=config['threshold'],
+        hist_threshold=config['hist_threshold'],
+        min_interval=config['min_interval'],
+        max_interval=config['max_interval']
+    )
@@ -0,0 +1,159 @@
+import json
+import os
+import shutil
+import time
+from ultralytics import YOLO
+
+# Inference backend selection
+# backend: 'pytorch' (eager .pt), 'onnx' (ONNX Runtime CPU) or 'openvino'
+# quantization: None, 'dynamic' or 'static' INT8 (onnx backend only)
+BACKEND_CONFIG = {
+    'backend': 'pytorch',
+    'detector_weights': 'best.pt',
+    'classifier_weights': 'last.pt',
+    'export_dir': 'exported_models',
+    'export_on_startup': True,
+    'quantization': None,
+    'calibration_dir': 'calibration_images',
+    'calibration_samples': 64
+}
+
+EXPORT_FORMATS = {
+    'onnx': {'suffix': '.onnx', 'args': {'dynamic': True, 'simplify': True}},
+    'openvino': {'suffix': '_openvino_model', 'args': {'dynamic': True}}
+}
+
+MANIFEST_NAME = 'manifest.json'
+
+def _source_signature(weights):
+    stat = os.stat(weights)
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+def _read_manifest(export_dir):
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Read export manifest failed: {e}")
+        return {}
+
+def _write_manifest(export_dir, manifest):
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _manifest_key(weights, fmt):
+    return f"{os.path.basename(weights)}:{fmt}"
+
+def find_export(weights, fmt, export_dir=None):
+    """Return the manifest entry of an up-to-date export of weights, or None"""
+    export_dir = export_dir or BACKEND_CONFIG['export_dir']
+    entry = _read_manifest(export_dir).get(_manifest_key(weights, fmt))
+    if not entry or not os.path.exists(entry['path']):
+        return None
+    if entry.get('source') != _source_signature(weights):
+        return None
+    return entry
+
+def export_model(weights, fmt, export_dir=None):
+    """Export a .pt checkpoint to fmt and record it in the export manifest"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    export_dir = export_dir or BACKEND_CONFIG['export_dir']
+    os.makedirs(export_dir, exist_ok=True)
+
+    export_start = time.time()
+    model = YOLO(weights)
+    imgsz = model.overrides.get('imgsz')
+    exported = model.export(format=fmt, imgsz=imgsz, **EXPORT_FORMATS[fmt]['args'])
+
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    target = os.path.join(export_dir, stem + EXPORT_FORMATS[fmt]['suffix'])
+    if os.path.abspath(str(exported)) != os.path.abspath(target):
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        elif os.path.exists(target):
+            os.unlink(target)
+        shutil.move(str(exported), target)
+
+    entry = {
+        'path': target,
+        'task': model.task,
+        'imgsz': imgsz,
+        'source': _source_signature(weights),
+        'exported_at': time.time()
+    }
+    manifest = _read_manifest(export_dir)
+    manifest[_manifest_key(weights, fmt)] = entry
+    _write_manifest(export_dir, manifest)
+
+    print(f"模型导出完成: {weights} -> {target} ({time.time() - export_start:.2f}s)")
+    return entry
+
+def quantize_model(weights, mode, export_dir=None, allow_export=True):
+    """INT8-quantize the ONNX export of weights and record it in the manifest"""
+    from app.services.quantization import quantize_onnx
+
+    export_dir = export_dir or BACKEND_CONFIG['export_dir']
+    entry = find_export(weights, 'onnx', export_dir)
+    if entry is None:
+        if not allow_export:
+            raise FileNotFoundError(f"No up-to-date onnx export for {weights}")
+        entry = export_model(weights, 'onnx', export_dir)
+
+    quantized = dict(entry)
+    quantized['path'] = quantize_onnx(
+        entry, mode,
+        calibration_dir=BACKEND_CONFIG['calibration_dir'],
+        calibration_samples=BACKEND_CONFIG['calibration_samples']
+    )
+    quantized['quantization'] = mode
+    quantized['exported_at'] = time.time()
+
+    manifest = _read_manifest(export_dir)
+    manifest[_manifest_key(weights, f'onnx-int8-{mode}')] = quantized
+    _write_manifest(export_dir, manifest)
+    return quantized
+
+def load_model(weights, backend=None, quantization=None, export_dir=None, allow_export=None):
+    """Load weights on the configured backend, falling back to PyTorch on failure.
+
+    Returns (model, backend_name) where backend_name is the backend actually used,
+    e.g. 'onnx-int8-dynamic' for a quantized ONNX model.
+    """
+    backend = backend or BACKEND_CONFIG['backend']
+    if quantization is None:
+        quantization = BACKEND_CONFIG['quantization']
+    if allow_export is None:
+        allow_export = BACKEND_CONFIG['export_on_startup']
+
+    if backend != 'pytorch':
+        try:
+            if quantization:
+                if backend != 'onnx':
+                    raise ValueError(f"INT8 quantization requires the onnx backend, got {backend}")
+                backend = f'onnx-int8-{quantization}'
+                entry = find_export(weights, backend, export_dir)
+                if entry is None:
+                    entry = quantize_model(weights, quantization, export_dir, allow_export)
+            else:
+                entry = find_export(weights, backend, export_dir)
+                if entry is None:
+                    if not allow_export:
+                        raise FileNotFoundError(f"No up-to-date {backend} export for {weights}")
+                    entry = export_model(weights, backend, export_dir)
+
+            model = YOLO(entry['path'], task=entry['task'])
+            if entry.get('imgsz'):
+                model.overrides['imgsz'] = entry['imgsz']
+            return model, backend
+        except Exception as e:
+            print(f"{backend} 后端加载失败, 回退到 PyTorch: {weights}: {e}")
+
+    return YOLO(weights), 'pytorch'
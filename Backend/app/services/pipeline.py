@@ -0,0 +1,406 @@
+import base64
+import io
+import time
+import numpy as np
+from PIL import Image
+from app.services.postprocess import Detections
+from app.services.preprocess import DETECT_IMGSZ, color_order
+from app.services.tiling import TILING_CONFIG, tile_grid, merge_detections
+
+# Per-mode stage parameters
+# decode: optional {'draft_to': n}; JPEG uploads are decoded at the smallest DCT
+#         scale (1/2, 1/4, 1/8) whose longest side is still >= n
+# resize: None, or bounds on the longest side; frames outside them are rescaled
+#         to the matching *_to size with the given PIL filter
+# scaleup: False letterboxes small frames without upsampling them
+# detect_args: extra detector arguments (conf/iou/max_det)
+# classify: False stops after detection, the caller classifies (e.g. once per video track)
+# output: 'full' for /api/predict style dicts, 'realtime' for the slim realtime dicts
+PROFILES = {
+    'single': {
+        'resize': None,
+        'detect_args': {},
+        'min_confidence': None,
+        'annotate': False,
+        'output': 'full'
+    },
+    'single_realtime': {
+        'resize': {'downscale_above': 1024, 'downscale_to': 960, 'filter': Image.Resampling.LANCZOS},
+        'detect_args': {},
+        'min_confidence': None,
+        'annotate': False,
+        'output': 'full'
+    },
+    'batch': {
+        'resize': None,
+        'detect_args': {},
+        'min_confidence': None,
+        'annotate': True,
+        'output': 'full'
+    },
+    'realtime': {
+        # The letterbox is the only resize: draft decode lands near the model input size
+        'decode': {'draft_to': DETECT_IMGSZ},
+        'resize': None,
+        'scaleup': False,
+        'detect_args': {'conf': 0.3, 'iou': 0.45, 'max_det': 50},
+        'min_confidence': 0.3,
+        'annotate': False,
+        'output': 'realtime'
+    },
+    'video_keyframe': {
+        'resize': None,
+        'detect_args': {},
+        'min_confidence': None,
+        'annotate': False,
+        'output': 'full'
+    },
+    'video_tracked': {
+        'resize': None,
+        'detect_args': {},
+        'min_confidence': None,
+        'classify': False,
+        'annotate': False,
+        'output': 'full'
+    }
+}
+
+STAGES = ('decode', 'resize', 'detect', 'crop', 'classify')
+INFERENCE_STAGES = ('resize', 'detect', 'crop', 'classify')
+
+# Annotated output encoding
+# max_dimension: longest side of the returned image, None keeps the input size
+OUTPUT_CONFIG = {
+    'format': 'PNG',
+    'quality': 90,
+    'max_dimension': None,
+    'png_compress_level': 1,
+    'encode_threads': 4,
+    'min_dimension': 64,
+    'max_dimension_limit': 8192
+}
+
+OUTPUT_FORMATS = {
+    'PNG': ('png', 'image/png'),
+    'JPEG': ('jpg', 'image/jpeg'),
+    'WEBP': ('webp', 'image/webp')
+}
+
+def default_output():
+    return {
+        'format': OUTPUT_CONFIG['format'],
+        'quality': OUTPUT_CONFIG['quality'],
+        'max_dimension': OUTPUT_CONFIG['max_dimension']
+    }
+
+def parse_output_options(values):
+    """Validate per-request output options from a form/query mapping.
+
+    Returns (annotate, output) where output holds encode_image keyword arguments.
+    Raises ValueError with a user-facing message on bad input.
+    """
+    annotate = str(values.get('annotate', '1')).lower() not in ('0', 'false', 'no', 'off')
+    output = default_output()
+
+    output_format = str(values.get('output_format', output['format'])).upper()
+    if output_format == 'JPG':
+        output_format = 'JPEG'
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError('输出格式仅支持 PNG、JPEG、WEBP')
+    output['format'] = output_format
+
+    try:
+        output['quality'] = int(values.get('output_quality', output['quality']))
+        max_dimension = values.get('max_output_dimension')
+        if max_dimension not in (None, ''):
+            output['max_dimension'] = int(max_dimension)
+    except (TypeError, ValueError):
+        raise ValueError('输出参数格式错误')
+
+    if not 1 <= output['quality'] <= 100:
+        raise ValueError('输出质量需在 1-100 之间')
+    if output['max_dimension'] is not None and not (
+            OUTPUT_CONFIG['min_dimension'] <= output['max_dimension'] <= OUTPUT_CONFIG['max_dimension_limit']):
+        raise ValueError(f"输出尺寸需在 {OUTPUT_CONFIG['min_dimension']}-{OUTPUT_CONFIG['max_dimension_limit']} 之间")
+
+    return annotate, output
+
+def _sniff_format(data):
+    if data[:3] == b'\xff\xd8\xff':
+        return 'JPEG'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'PNG'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+def _store_encoded(data, format, artifacts):
+    extension, mimetype = OUTPUT_FORMATS[format]
+    if artifacts is None:
+        return f"data:{mimetype};base64,{base64.b64encode(data).decode('utf-8')}"
+    return artifacts.put_bytes(data, extension)
+
+def encode_image(image, artifacts=None, format='PNG', quality=90, max_dimension=None):
+    """Encode image and return an artifact URL, or a data URL when no store is configured"""
+    if max_dimension and max(image.size) > max_dimension:
+        scale = max_dimension / max(image.size)
+        image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                             Image.Resampling.BILINEAR)
+
+    if format == 'PNG':
+        save_args = {'compress_level': OUTPUT_CONFIG['png_compress_level']}
+    else:
+        save_args = {'quality': quality}
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    with io.BytesIO() as output:
+        image.save(output, format=format, **save_args)
+        return _store_encoded(output.getvalue(), format, artifacts)
+
+def encode_upload(image_data, image_size, artifacts=None, max_dimension=None, output_format=None):
+    """Reuse the uploaded bytes as the output when they need no re-encoding, else None.
+
+    The upload is only reused when it is already in output_format and within max_dimension.
+    """
+    format = _sniff_format(image_data) if image_data else None
+    if format is None or (output_format and format != output_format):
+        return None
+    if max_dimension and max(image_size) > max_dimension:
+        return None
+    return _store_encoded(image_data, format, artifacts)
+
+def _target_size(width, height, spec):
+    max_dim = max(width, height)
+    if spec.get('upscale_below') and max_dim < spec['upscale_below']:
+        scale = spec['upscale_to'] / max_dim
+    elif spec.get('downscale_above') and max_dim > spec['downscale_above']:
+        scale = spec['downscale_to'] / max_dim
+    else:
+        return None
+    return int(width * scale), int(height * scale)
+
+class StageContext:
+    """Per-image state passed through the pipeline stages"""
+    def __init__(self, image=None, image_data=None, tiling=None):
+        self.image = image
+        self.image_data = image_data
+        self.tiling = tiling
+        self.source_size = None
+        self.detections = None
+        self.crops = []
+        self.sub_results = []
+        self.encoded = None
+        self.tiling_info = None
+        self.letterbox_ms = 0.0
+        self.timings = {}
+
+    def predictions(self):
+        return self.detections.to_predictions(self.sub_results)
+
+class InferencePipeline:
+    """decode -> resize -> detect -> crop -> classify -> annotate -> encode.
+
+    Every stage runs over a list of contexts at once so detection and
+    classification are batched; each stage's wall time is split evenly over the
+    contexts and recorded in ctx.timings under the stage name.
+    """
+    def __init__(self, model_worker):
+        self.worker = model_worker
+
+    def run(self, contexts, profile, annotate=None, batch_size=8, output=None):
+        """Run the batched inference stages, then annotate/encode each context when requested"""
+        profile = PROFILES[profile] if isinstance(profile, str) else profile
+        annotate = profile['annotate'] if annotate is None else annotate
+
+        for stage in STAGES:
+            stage_start = time.time()
+            getattr(self, f'_{stage}')(contexts, profile, batch_size)
+            elapsed = (time.time() - stage_start) * 1000 / len(contexts)
+            for ctx in contexts:
+                ctx.timings[stage] = elapsed
+                if stage == 'detect' and ctx.letterbox_ms:
+                    # detect_batch letterboxes inside the detect stage; report it as resize
+                    ctx.timings['detect'] -= ctx.letterbox_ms
+                    ctx.timings['resize'] = ctx.timings.get('resize', 0) + ctx.letterbox_ms
+
+        if annotate:
+            for ctx in contexts:
+                self.render_output(ctx, output)
+
+        return contexts
+
+    def render_output(self, ctx, output=None):
+        """Annotate and encode one context; safe to run on a thread pool after run()"""
+        output = output or default_output()
+
+        annotate_start = time.time()
+        if len(ctx.detections):
+            frame = np.array(ctx.image)
+            self.worker.renderer.draw_detections(frame, ctx.detections, ctx.sub_results)
+            annotated = Image.fromarray(frame)
+        else:
+            annotated = None
+        ctx.timings['annotate'] = (time.time() - annotate_start) * 1000
+
+        encode_start = time.time()
+        ctx.encoded = None
+        if annotated is None:
+            # Nothing drawn: hand back the upload itself instead of re-encoding it
+            ctx.encoded = encode_upload(ctx.image_data, ctx.source_size, self.worker.artifacts,
+                                        output['max_dimension'], output['format'])
+        if ctx.encoded is None:
+            ctx.encoded = encode_image(annotated if annotated is not None else ctx.image,
+                                       self.worker.artifacts, **output)
+        ctx.timings['encode'] = (time.time() - encode_start) * 1000
+        return ctx
+
+    def _decode(self, contexts, profile, batch_size):
+        draft_to = (profile.get('decode') or {}).get('draft_to')
+        for ctx in contexts:
+            if ctx.image is None:
+                ctx.image = Image.open(io.BytesIO(ctx.image_data))
+                ctx.source_size = ctx.image.size
+                if draft_to and ctx.image.format == 'JPEG':
+                    width, height = ctx.image.size
+                    scale = draft_to / max(width, height)
+                    if scale < 1:
+                        ctx.image.draft('RGB', (int(width * scale), int(height * scale)))
+                # Decode now so the time lands in the decode stage, not in detect
+                ctx.image.load()
+            # Video frames arrive as FrameViews and are used as decoded
+            if isinstance(ctx.image, Image.Image) and ctx.image.mode != 'RGB':
+                ctx.image = ctx.image.convert('RGB')
+
+    def _resize(self, contexts, profile, batch_size):
+        spec = profile['resize']
+        for ctx in contexts:
+            if ctx.source_size is None:
+                ctx.source_size = ctx.image.size
+            if not spec:
+                continue
+            size = _target_size(ctx.image.width, ctx.image.height, spec)
+            if size:
+                ctx.image = ctx.image.resize(size, spec['filter'])
+
+    def _detect(self, contexts, profile, batch_size):
+        plain = [ctx for ctx in contexts if not ctx.tiling]
+        if plain:
+            detections = self.worker.detect_batch([ctx.image for ctx in plain], batch_size=batch_size,
+                                                  scaleup=profile.get('scaleup', True), **profile['detect_args'])
+            for ctx, det in zip(plain, detections):
+                ctx.detections = det
+                ctx.letterbox_ms = det.letterbox_ms
+
+        for ctx in contexts:
+            if ctx.tiling:
+                self._detect_tiled(ctx, batch_size, profile['detect_args'])
+            if profile['min_confidence'] is not None:
+                ctx.detections = ctx.detections.filter(ctx.detections.conf >= profile['min_confidence'])
+
+    def _detect_tiled(self, ctx, batch_size, detect_args):
+        img = ctx.image
+        tile_size = ctx.tiling.get('tile_size') or TILING_CONFIG['tile_size']
+        overlap = ctx.tiling.get('overlap')
+        overlap = TILING_CONFIG['overlap'] if overlap is None else overlap
+
+        tiles = tile_grid(img.width, img.height, tile_size, overlap)
+        tile_images = [img.crop((x, y, x + w, y + h)) for x, y, w, h in tiles]
+        offsets = [(x, y) for x, y, _, _ in tiles]
+        if TILING_CONFIG['include_full_frame'] and len(tiles) > 1:
+            tile_images.append(img)
+            offsets.append((0, 0))
+
+        detections = self.worker.detect_batch(tile_images, batch_size=batch_size, **detect_args)
+
+        tile_stats = []
+        for (x, y), tile_img, det in zip(offsets, tile_images, detections):
+            det.xyxy[:, [0, 2]] += x
+            det.xyxy[:, [1, 3]] += y
+            tile_stats.append({
+                "x": x,
+                "y": y,
+                "width": tile_img.width,
+                "height": tile_img.height,
+                "full_frame": tile_img is img,
+                "detections": len(det),
+                "time_ms": det.time_ms
+            })
+
+        merge_start = time.time()
+        xyxy, conf, cls = merge_detections(
+            np.concatenate([d.xyxy for d in detections]),
+            np.concatenate([d.conf for d in detections]),
+            np.concatenate([d.cls for d in detections]),
+            iou_threshold=TILING_CONFIG['merge_iou'],
+            ios_threshold=TILING_CONFIG['merge_ios']
+        )
+        ctx.detections = Detections(xyxy, conf, cls, img.width, img.height)
+
+        ctx.tiling_info = {
+            "tile_size": tile_size,
+            "overlap": overlap,
+            "tile_count": len(tile_stats),
+            "raw_detections": sum(t["detections"] for t in tile_stats),
+            "merge_time_ms": (time.time() - merge_start) * 1000,
+            "tiles": tile_stats
+        }
+
+    def _crop(self, contexts, profile, batch_size):
+        if not profile.get('classify', True):
+            return
+        for ctx in contexts:
+            ctx.crops = ctx.detections.crops(np.asarray(ctx.image)) if len(ctx.detections) else []
+
+    def _classify(self, contexts, profile, batch_size):
+        if not profile.get('classify', True):
+            return
+        # Crops are classified in one batch per channel order (BGR for video frame slices)
+        for order in {color_order(ctx.image) for ctx in contexts}:
+            group = [ctx for ctx in contexts if color_order(ctx.image) == order]
+            all_crops = [crop for ctx in group for crop in ctx.crops]
+            sub_results = self.worker.classify_crops(all_crops, crop_order=order)
+
+            offset = 0
+            for ctx in group:
+                ctx.sub_results = sub_results[offset:offset + len(ctx.crops)]
+                ctx.crops = []
+                offset += len(ctx.sub_results)
+
+    def format_result(self, ctx, profile, columnar=False):
+        """Build the response dict for one context in the profile's output format"""
+        profile = PROFILES[profile] if isinstance(profile, str) else profile
+        timings = ctx.timings
+        inference_time = sum(timings.get(stage, 0) for stage in INFERENCE_STAGES)
+
+        if profile['output'] == 'realtime':
+            return {
+                "predictions": ctx.detections.to_realtime_predictions(
+                    [r["defect_status"] for r in ctx.sub_results]),
+                "inference_time_ms": inference_time,
+                "decode_time_ms": timings.get('decode', 0) + timings.get('resize', 0),
+                "detected_objects": len(ctx.detections),
+                "realtime_optimized": True,
+                "processed_size": f"{ctx.image.width}x{ctx.image.height}",
+                "original_size": f"{ctx.source_size[0]}x{ctx.source_size[1]}",
+                "stage_times_ms": dict(timings)
+            }
+
+        result = {
+            "inference_time_ms": inference_time,
+            "main_model_time_ms": timings.get('detect', 0),
+            "sub_model_time_ms": timings.get('classify', 0),
+            "crop_time_ms": timings.get('crop', 0),
+            "detected_objects": len(ctx.detections),
+            "stage_times_ms": dict(timings)
+        }
+        if columnar:
+            result["columns"] = ctx.detections.to_columns(ctx.sub_results)
+        else:
+            result["predictions"] = ctx.predictions()
+        if ctx.tiling_info:
+            result["tiling"] = ctx.tiling_info
+            result["merge_time_ms"] = ctx.tiling_info["merge_time_ms"]
+        if ctx.encoded:
+            result["annotated_image"] = ctx.encoded
+        return result
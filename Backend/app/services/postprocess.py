@@ -0,0 +1,168 @@
+import numpy as np
+
+# Class Mappings
+CLASS_MAPPING = {
+    0: 'yoke', 1: 'yoke suspension', 2: 'spacer', 3: 'stockbridge damper',
+    4: 'lightning rod shackle', 5: 'lightning rod suspension', 6: 'polymer insulator',
+    7: 'glass insulator', 8: 'tower id plate', 9: 'vari-grip',
+    10: 'polymer insulator lower shackle', 11: 'polymer insulator upper shackle',
+    12: 'polymer insulator tower shackle', 13: 'glass insulator big shackle',
+    14: 'glass insulator small shackle', 15: 'glass insulator tower shackle',
+    16: 'spiral damper', 17: 'sphere'
+}
+
+CLASS_MAPPING_ZH = {
+    0: '横担', 1: '横担悬挂', 2: '间隔棒', 3: '斯托克布里奇阻尼器',
+    4: '避雷针卸扣', 5: '避雷针悬挂', 6: '聚合物绝缘子',
+    7: '玻璃绝缘子', 8: '塔身标识牌', 9: '防振锤',
+    10: '聚合物绝缘子下卸扣', 11: '聚合物绝缘子上卸扣',
+    12: '聚合物绝缘子塔用卸扣', 13: '玻璃绝缘子大卸扣',
+    14: '玻璃绝缘子小卸扣', 15: '玻璃绝缘子塔用卸扣',
+    16: '螺旋阻尼器', 17: '球'
+}
+
+# Lookup arrays indexed by class id
+CLASS_NAMES_EN = np.array([CLASS_MAPPING[i] for i in range(len(CLASS_MAPPING))], dtype=object)
+CLASS_NAMES_ZH = np.array([CLASS_MAPPING_ZH[i] for i in range(len(CLASS_MAPPING_ZH))], dtype=object)
+
+DEFAULT_SUB_RESULT = {"subclass_id": None, "subconfidence": 0.0, "defect_status": "正常"}
+
+def _lookup(names, cls, unknown_format):
+    known = (cls >= 0) & (cls < len(names))
+    out = np.empty(len(cls), dtype=object)
+    out[known] = names[cls[known]]
+    for i in np.nonzero(~known)[0]:
+        out[i] = unknown_format.format(int(cls[i]))
+    return out
+
+class Detections:
+    """Columnar detector output for one image.
+
+    xyxy is an (N, 4) float32 array in pixel coordinates of an image of size
+    width x height; conf and cls are (N,) arrays. Per-box dicts are only built at
+    the JSON boundary by to_predictions/to_realtime_predictions.
+    """
+    def __init__(self, xyxy, conf, cls, width, height, time_ms=0.0):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        self.cls = np.asarray(cls, dtype=int).reshape(-1)
+        self.width = width
+        self.height = height
+        self.time_ms = time_ms
+
+    @classmethod
+    def from_boxes(cls, boxes, width, height, time_ms=0.0):
+        """Pull xyxy/conf/cls out of an ultralytics Boxes object in one go"""
+        return cls(
+            boxes.xyxy.cpu().numpy(),
+            boxes.conf.cpu().numpy(),
+            boxes.cls.cpu().numpy(),
+            width, height, time_ms
+        )
+
+    @classmethod
+    def empty(cls, width, height):
+        return cls(np.zeros((0, 4)), np.zeros(0), np.zeros(0), width, height)
+
+    def __len__(self):
+        return len(self.xyxy)
+
+    def filter(self, mask):
+        return Detections(self.xyxy[mask], self.conf[mask], self.cls[mask],
+                          self.width, self.height, self.time_ms)
+
+    def normalized(self):
+        """Normalized centers, widths and heights as (cx, cy, w, h) arrays"""
+        x1, y1, x2, y2 = self.xyxy.T
+        return (
+            (x1 + x2) / 2 / self.width,
+            (y1 + y2) / 2 / self.height,
+            (x2 - x1) / self.width,
+            (y2 - y1) / self.height
+        )
+
+    def crop_rects(self):
+        """Integer crop rectangles clipped to the image, at least one pixel wide"""
+        rects = self.xyxy.astype(int)
+        rects[:, 0] = np.clip(rects[:, 0], 0, self.width - 1)
+        rects[:, 1] = np.clip(rects[:, 1], 0, self.height - 1)
+        rects[:, 2] = np.maximum(rects[:, 0] + 1, np.minimum(rects[:, 2], self.width))
+        rects[:, 3] = np.maximum(rects[:, 1] + 1, np.minimum(rects[:, 3], self.height))
+        return rects
+
+    def crops(self, img_array):
+        """Crop views into an HWC array, one per box"""
+        return [img_array[y1:y2, x1:x2] for x1, y1, x2, y2 in self.crop_rects().tolist()]
+
+    def class_names(self):
+        return (_lookup(CLASS_NAMES_EN, self.cls, "unknown_class_{}"),
+                _lookup(CLASS_NAMES_ZH, self.cls, "未知类别_{}"))
+
+    def to_columns(self, sub_results=None):
+        """Column-oriented JSON form: one list per field instead of one dict per box"""
+        cx, cy, w, h = self.normalized()
+        names_en, names_zh = self.class_names()
+        sub_results = sub_results or [DEFAULT_SUB_RESULT] * len(self)
+        return {
+            "bbox": self.xyxy.astype(int).tolist(),
+            "center_x": cx.tolist(),
+            "center_y": cy.tolist(),
+            "width": w.tolist(),
+            "height": h.tolist(),
+            "class_id": self.cls.tolist(),
+            "class_name": names_en.tolist(),
+            "class_name_zh": names_zh.tolist(),
+            "confidence": self.conf.tolist(),
+            "subclass_id": [r["subclass_id"] for r in sub_results],
+            "subconfidence": [r["subconfidence"] for r in sub_results],
+            "defect_status": [r["defect_status"] for r in sub_results]
+        }
+
+    def to_predictions(self, sub_results=None):
+        """Per-box prediction dicts in the /api/predict response format"""
+        if len(self) == 0:
+            return []
+
+        xyxy = self.xyxy.tolist()
+        bbox = self.xyxy.astype(int).tolist()
+        cx, cy, w, h = (a.tolist() for a in self.normalized())
+        names_en, names_zh = (a.tolist() for a in self.class_names())
+        cls = self.cls.tolist()
+        conf = self.conf.tolist()
+        sub_results = sub_results or [DEFAULT_SUB_RESULT] * len(self)
+
+        return [
+            dict({
+                "bbox": bbox[i],
+                "box": [x1, y1, x2 - x1, y2 - y1],
+                "center": {"x": cx[i], "y": cy[i]},
+                "width": w[i],
+                "height": h[i],
+                "class_id": cls[i],
+                "class_name": names_en[i],
+                "class_name_zh": names_zh[i],
+                "asset_category": names_zh[i],
+                "confidence": conf[i]
+            }, **sub_results[i])
+            for i, (x1, y1, x2, y2) in enumerate(xyxy)
+        ]
+
+    def to_realtime_predictions(self, defect_statuses):
+        """Slim per-box dicts used by the realtime endpoint"""
+        cx, cy, w, h = (a.tolist() for a in self.normalized())
+        _, names_zh = self.class_names()
+        names_zh = names_zh.tolist()
+        conf = self.conf.tolist()
+        cls = self.cls.tolist()
+        return [
+            {
+                "center": {"x": cx[i], "y": cy[i]},
+                "width": w[i],
+                "height": h[i],
+                "asset_category": names_zh[i],
+                "confidence": conf[i],
+                "defect_status": defect_statuses[i],
+                "class_id": cls[i]
+            }
+            for i in range(len(self))
+        ]
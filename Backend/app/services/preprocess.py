@@ -0,0 +1,116 @@
+import math
+import cv2
+import numpy as np
+import torch
+
+# Detector input size and stride used when letterboxing batches ourselves
+DETECT_IMGSZ = 640
+DETECT_STRIDE = 32
+LETTERBOX_FILL = 114
+
+class FrameView:
+    """A decoded video frame as an HWC uint8 array, without copying or converting it.
+
+    Exposes width/height/size like a PIL image so the inference stages can take
+    it in place of one; np.asarray(view) returns the wrapped array itself.
+    """
+    def __init__(self, array, color_order='BGR'):
+        self.array = array
+        self.color_order = color_order
+
+    @property
+    def width(self):
+        return self.array.shape[1]
+
+    @property
+    def height(self):
+        return self.array.shape[0]
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def resize(self, size, resample=None):
+        return FrameView(cv2.resize(self.array, size, interpolation=cv2.INTER_AREA), self.color_order)
+
+def color_order(image):
+    return getattr(image, 'color_order', 'RGB')
+
+def group_by_aspect_ratio(images, batch_size):
+    """Split image indices into batches of similar height/width ratio"""
+    order = sorted(range(len(images)), key=lambda i: images[i].height / images[i].width)
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+def batch_shape(images, imgsz=DETECT_IMGSZ, stride=DETECT_STRIDE, scaleup=True):
+    """Smallest stride-aligned (h, w) canvas that fits every image of the group.
+
+    With scaleup=False the canvas shrinks to the group's largest side when that
+    is below imgsz, so small images are padded instead of upsampled.
+    """
+    if not scaleup:
+        imgsz = min(imgsz, max(max(img.width, img.height) for img in images))
+    ratios = [img.height / img.width for img in images]
+    min_ratio, max_ratio = min(ratios), max(ratios)
+    if max_ratio < 1:
+        shape = (max_ratio, 1.0)
+    elif min_ratio > 1:
+        shape = (1.0, 1 / min_ratio)
+    else:
+        shape = (1.0, 1.0)
+    return tuple(int(math.ceil(s * imgsz / stride) * stride) for s in shape)
+
+def letterbox_batch(images, imgsz=DETECT_IMGSZ, stride=DETECT_STRIDE, scaleup=True):
+    """Letterbox a group of RGB images (or BGR FrameViews) into one BCHW RGB float tensor.
+
+    BGR frames are resized first and flipped to RGB while copying into the
+    canvas, so the full-size frame is never converted. Images that already
+    fit at gain 1 are copied without resizing. Returns the tensor and
+    per-image (gain, pad_x, pad_y) needed to map boxes back.
+    """
+    canvas_h, canvas_w = batch_shape(images, imgsz, stride, scaleup)
+    canvas = np.full((len(images), canvas_h, canvas_w, 3), LETTERBOX_FILL, dtype=np.uint8)
+    transforms = []
+    
+    for i, img in enumerate(images):
+        gain = min(canvas_h / img.height, canvas_w / img.width)
+        if not scaleup:
+            gain = min(gain, 1.0)
+        new_w = max(1, int(round(img.width * gain)))
+        new_h = max(1, int(round(img.height * gain)))
+        pad_x = (canvas_w - new_w) // 2
+        pad_y = (canvas_h - new_h) // 2
+        
+        resized = np.asarray(img)
+        if (new_w, new_h) != (img.width, img.height):
+            resized = cv2.resize(resized, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        if color_order(img) == 'BGR':
+            resized = resized[..., ::-1]
+        canvas[i, pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+        transforms.append((gain, pad_x, pad_y))
+    
+    tensor = torch.from_numpy(canvas).permute(0, 3, 1, 2).contiguous().float().div_(255.0)
+    return tensor, transforms
+
+def classify_batch(crops, size, crop_order='RGB'):
+    """Resize-shortest-side + center-crop crops into one BCHW RGB float tensor.
+
+    crop_order is the channel order of the crops; BGR crops (slices of video
+    frames) are flipped after resizing.
+    """
+    batch = np.empty((len(crops), size, size, 3), dtype=np.uint8)
+    
+    for i, crop in enumerate(crops):
+        h, w = crop.shape[:2]
+        scale = size / min(h, w)
+        new_w = max(size, int(round(w * scale)))
+        new_h = max(size, int(round(h * scale)))
+        resized = cv2.resize(crop, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        top = (new_h - size) // 2
+        left = (new_w - size) // 2
+        resized = resized[top:top + size, left:left + size]
+        batch[i] = resized[..., ::-1] if crop_order == 'BGR' else resized
+    
+    return torch.from_numpy(batch).permute(0, 3, 1, 2).contiguous().float().div_(255.0)
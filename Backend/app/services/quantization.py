@@ -0,0 +1,192 @@
+import os
+import time
+import numpy as np
+from PIL import Image
+from app.services.preprocess import DETECT_IMGSZ, letterbox_batch, classify_batch
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+def list_images(folder, limit=None):
+    """Sorted image paths under folder, optionally truncated to limit"""
+    paths = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return paths[:limit] if limit else paths
+
+def _load_rgb(path):
+    image = Image.open(path)
+    return image.convert('RGB') if image.mode != 'RGB' else image
+
+class CalibrationReader:
+    """onnxruntime CalibrationDataReader feeding preprocessed sample images"""
+    def __init__(self, input_name, task, image_paths, imgsz):
+        self.input_name = input_name
+        self.task = task
+        self.image_paths = list(image_paths)
+        self.imgsz = imgsz
+        self.index = 0
+
+    def get_next(self):
+        if self.index >= len(self.image_paths):
+            return None
+        image = _load_rgb(self.image_paths[self.index])
+        self.index += 1
+
+        if self.task == 'classify':
+            tensor = classify_batch([np.asarray(image)], self.imgsz)
+        else:
+            tensor, _ = letterbox_batch([image], imgsz=self.imgsz)
+        return {self.input_name: tensor.numpy()}
+
+    def rewind(self):
+        self.index = 0
+
+def _copy_metadata(source_path, target_path):
+    # ultralytics reads names/stride/imgsz from the ONNX metadata props
+    import onnx
+    source = onnx.load(source_path, load_external_data=False)
+    target = onnx.load(target_path)
+    del target.metadata_props[:]
+    target.metadata_props.extend(source.metadata_props)
+    onnx.save(target, target_path)
+
+def quantize_onnx(entry, mode, calibration_dir=None, calibration_samples=64):
+    """INT8-quantize an exported ONNX model, returning the quantized model path.
+
+    mode 'dynamic' quantizes weights only; 'static' also calibrates activations
+    on up to calibration_samples images from calibration_dir.
+    """
+    from onnxruntime import InferenceSession
+    from onnxruntime.quantization import (
+        QuantFormat, QuantType, quantize_dynamic, quantize_static
+    )
+
+    source_path = entry['path']
+    target_path = source_path.replace('.onnx', f'_int8_{mode}.onnx')
+    quant_start = time.time()
+
+    if mode == 'dynamic':
+        quantize_dynamic(source_path, target_path, weight_type=QuantType.QInt8)
+    elif mode == 'static':
+        if not calibration_dir or not os.path.isdir(calibration_dir):
+            raise FileNotFoundError(f"Calibration folder not found: {calibration_dir}")
+        image_paths = list_images(calibration_dir, calibration_samples)
+        if not image_paths:
+            raise FileNotFoundError(f"No calibration images in {calibration_dir}")
+
+        imgsz = entry.get('imgsz') or (224 if entry['task'] == 'classify' else DETECT_IMGSZ)
+        if isinstance(imgsz, (list, tuple)):
+            imgsz = imgsz[0]
+        session = InferenceSession(source_path, providers=['CPUExecutionProvider'])
+        reader = CalibrationReader(session.get_inputs()[0].name, entry['task'], image_paths, int(imgsz))
+        del session
+
+        quantize_static(
+            source_path, target_path, reader,
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True
+        )
+    else:
+        raise ValueError(f"Unsupported quantization mode: {mode}")
+
+    _copy_metadata(source_path, target_path)
+    print(f"模型量化完成 ({mode}): {target_path} ({time.time() - quant_start:.2f}s)")
+    return target_path
+
+def _box_iou(box_a, box_b):
+    x1 = max(box_a[0], box_b[0])
+    y1 = max(box_a[1], box_b[1])
+    x2 = min(box_a[2], box_b[2])
+    y2 = min(box_a[3], box_b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+    area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+def _match_predictions(reference, candidate, iou_threshold):
+    """Greedy highest-IoU matching of candidate boxes onto reference boxes"""
+    pairs = []
+    for i, ref in enumerate(reference):
+        for j, cand in enumerate(candidate):
+            iou = _box_iou(ref['bbox'], cand['bbox'])
+            if iou >= iou_threshold:
+                pairs.append((iou, i, j))
+
+    matched_ref, matched_cand, matches = set(), set(), []
+    for iou, i, j in sorted(pairs, reverse=True):
+        if i in matched_ref or j in matched_cand:
+            continue
+        matched_ref.add(i)
+        matched_cand.add(j)
+        matches.append((reference[i], candidate[j]))
+    return matches
+
+def parity_report(reference_worker, candidate_worker, image_paths, iou_threshold=0.5):
+    """Compare candidate predictions against the FP32 reference on the same images"""
+    totals = {
+        'images': 0,
+        'reference_boxes': 0,
+        'candidate_boxes': 0,
+        'matched_boxes': 0,
+        'class_agreements': 0,
+        'defect_agreements': 0,
+        'box_count_agreements': 0,
+        'reference_time_ms': 0.0,
+        'candidate_time_ms': 0.0
+    }
+    per_image = []
+
+    for path in image_paths:
+        image = _load_rgb(path)
+        reference = reference_worker.predict(image)
+        candidate = candidate_worker.predict(image)
+
+        matches = _match_predictions(reference['predictions'], candidate['predictions'], iou_threshold)
+        class_agree = sum(1 for ref, cand in matches if ref['class_id'] == cand['class_id'])
+        defect_agree = sum(1 for ref, cand in matches if ref.get('defect_status') == cand.get('defect_status'))
+
+        totals['images'] += 1
+        totals['reference_boxes'] += reference['detected_objects']
+        totals['candidate_boxes'] += candidate['detected_objects']
+        totals['matched_boxes'] += len(matches)
+        totals['class_agreements'] += class_agree
+        totals['defect_agreements'] += defect_agree
+        totals['box_count_agreements'] += int(reference['detected_objects'] == candidate['detected_objects'])
+        totals['reference_time_ms'] += reference['inference_time_ms']
+        totals['candidate_time_ms'] += candidate['inference_time_ms']
+
+        per_image.append({
+            'image': os.path.basename(path),
+            'reference_boxes': reference['detected_objects'],
+            'candidate_boxes': candidate['detected_objects'],
+            'matched_boxes': len(matches),
+            'class_agreements': class_agree,
+            'defect_agreements': defect_agree
+        })
+
+    images = max(totals['images'], 1)
+    reference_boxes = max(totals['reference_boxes'], 1)
+    matched = max(totals['matched_boxes'], 1)
+
+    return {
+        'summary': {
+            'images': totals['images'],
+            'reference_boxes': totals['reference_boxes'],
+            'candidate_boxes': totals['candidate_boxes'],
+            'box_count_agreement': round(totals['box_count_agreements'] / images, 4),
+            'box_recall': round(totals['matched_boxes'] / reference_boxes, 4),
+            # Both agreements are over matched boxes; unmatched boxes are covered by box_recall
+            'class_agreement_of_matched': round(totals['class_agreements'] / matched, 4),
+            'defect_status_agreement_of_matched': round(totals['defect_agreements'] / matched, 4),
+            'reference_avg_time_ms': round(totals['reference_time_ms'] / images, 2),
+            'candidate_avg_time_ms': round(totals['candidate_time_ms'] / images, 2),
+            'speedup': round(totals['reference_time_ms'] / totals['candidate_time_ms'], 2)
+                       if totals['candidate_time_ms'] > 0 else None,
+            'iou_threshold': iou_threshold
+        },
+        'per_image': per_image
+    }
@@ -0,0 +1,416 @@
+import io
+import struct
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from app.services.postprocess import CLASS_NAMES_ZH
+from app.services.tracking import IoUTracker
+
+# Realtime detection sessions (WebSocket)
+# max_frame_bytes: larger frames are rejected
+# auth_timeout_s: time allowed for the auth message after connecting
+# idle_timeout_s: sessions with no frame for this long are closed
+# gate_*: near-duplicate frame gate. Frames whose difference hash is within
+#         gate_max_distance bits of the last inferred frame reuse its result, for
+#         at most gate_refresh_frames frames in a row and gate_refresh_s seconds
+# track_*: per-client IoU tracking; a box reuses its track's classifier result
+#          unless the track is new, its box overlaps the box it was classified at
+#          by less than track_reclassify_iou, or track_classify_refresh frames passed
+# delta_*: opt-in delta encoding; a full keyframe every delta_keyframe_interval
+#          responses, boxes re-sent once they move more than delta_box_tolerance
+#          (normalized) or confidence changes more than delta_conf_tolerance
+# http_sessions: HTTP client streams (keyed by user id and the client's stream_id) whose state is kept
+REALTIME_CONFIG = {
+    'max_frame_bytes': 4 * 1024 * 1024,
+    'auth_timeout_s': 10,
+    'idle_timeout_s': 120,
+    'gate_enabled': True,
+    'gate_hash_size': 16,
+    'gate_max_distance': 8,
+    'gate_refresh_frames': 15,
+    'gate_refresh_s': 2.0,
+    'tracking_enabled': True,
+    'track_iou_threshold': 0.3,
+    'track_max_missed': 5,
+    'track_classify_refresh': 30,
+    'track_reclassify_iou': 0.5,
+    'delta_keyframe_interval': 30,
+    'delta_box_tolerance': 0.002,
+    'delta_conf_tolerance': 0.05,
+    'http_sessions': 256,
+    'max_stream_id_length': 64
+}
+
+# Binary frame messages: 4-byte big-endian frame id followed by the encoded image
+FRAME_HEADER = struct.Struct('>I')
+
+def parse_frame_message(message):
+    """(frame_id, image_data) from a binary frame message"""
+    if len(message) <= FRAME_HEADER.size:
+        raise ValueError('帧数据为空')
+    if len(message) > REALTIME_CONFIG['max_frame_bytes'] + FRAME_HEADER.size:
+        raise ValueError('帧数据过大')
+    return FRAME_HEADER.unpack_from(message)[0], message[FRAME_HEADER.size:]
+
+def format_realtime_result(result):
+    """Realtime response payload shared by the HTTP and WebSocket endpoints"""
+    predictions = result.get('predictions', [])
+    formatted_predictions = {}
+
+    for i, pred in enumerate(predictions):
+        formatted_predictions[i] = {
+            'asset_category': pred.get('asset_category', pred.get('class_name_zh', '')),
+            'defect_status': pred.get('defect_status', '正常'),
+            'confidence': round(pred.get('confidence', 0), 3),
+            'center': {
+                'x': round(pred.get('center', {}).get('x', 0), 4),
+                'y': round(pred.get('center', {}).get('y', 0), 4)
+            },
+            'width': round(pred.get('width', 0), 4),
+            'height': round(pred.get('height', 0), 4)
+        }
+
+    return {
+        'predictions': formatted_predictions,
+        'inference_time_ms': round(result.get('inference_time_ms', 0), 1),
+        'decode_time_ms': round(result.get('decode_time_ms', 0), 1),
+        'detected_objects': len(predictions),
+        'reused': result.get('reused', False)
+    }
+
+def frame_signature(image_data, hash_size=16):
+    """Difference hash of an encoded frame as a flat bool array of hash_size**2 bits.
+
+    JPEGs are decoded in draft mode at 1/8 scale, so this costs far less than
+    the detector's own decode.
+    """
+    image = Image.open(io.BytesIO(image_data))
+    image.draft('L', (hash_size * 4, hash_size * 4))
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    return (pixels[:, 1:] > pixels[:, :-1]).ravel()
+
+class FrameGate:
+    """Skips inference for frames that look like the last inferred one.
+
+    The last result is reused while the frame's hash stays within max_distance
+    bits of the last inferred frame, up to refresh_frames reuses in a row or
+    refresh_s seconds, after which the next frame is inferred again. Results
+    carrying an 'error' key are never cached.
+    """
+    def __init__(self, hash_size=16, max_distance=8, refresh_frames=15, refresh_s=2.0):
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+        self.refresh_frames = refresh_frames
+        self.refresh_s = refresh_s
+        self.lock = threading.Lock()
+        self.signature = None
+        self.result = None
+        self.inferred_at = 0
+        self.reuses = 0
+        self.reused_total = 0
+
+    def run(self, image_data, predict):
+        """predict(image_data=...) unless the frame is a near duplicate; adds a 'reused' flag"""
+        signature = frame_signature(image_data, self.hash_size)
+        with self.lock:
+            if (self.signature is not None and self.reuses < self.refresh_frames and
+                    time.time() - self.inferred_at < self.refresh_s):
+                distance = int(np.count_nonzero(signature != self.signature))
+                if distance <= self.max_distance:
+                    self.reuses += 1
+                    self.reused_total += 1
+                    return dict(self.result, reused=True, frame_distance=distance)
+
+        result = predict(image_data=image_data)
+        if 'error' in result:
+            # Failed inference is not a result to replay for the following frames
+            return dict(result, reused=False)
+        with self.lock:
+            self.signature = signature
+            self.result = result
+            self.inferred_at = time.time()
+            self.reuses = 0
+        return dict(result, reused=False)
+
+def create_gate(config=None):
+    """FrameGate from config, or None when the gate is disabled"""
+    config = config or REALTIME_CONFIG
+    if not config['gate_enabled']:
+        return None
+    return FrameGate(
+        hash_size=config['gate_hash_size'],
+        max_distance=config['gate_max_distance'],
+        refresh_frames=config['gate_refresh_frames'],
+        refresh_s=config['gate_refresh_s']
+    )
+
+def create_realtime_tracker(config=None):
+    """IoUTracker for one realtime client, or None when realtime tracking is disabled"""
+    config = config or REALTIME_CONFIG
+    if not config['tracking_enabled']:
+        return None
+    return IoUTracker(
+        iou_threshold=config['track_iou_threshold'],
+        max_missed=config['track_max_missed'],
+        classify_refresh=config['track_classify_refresh'],
+        reclassify_iou=config['track_reclassify_iou'],
+        keep_finished=False
+    )
+
+# Packed object rows: box as 1/10000 of the frame, confidence as 1/1000
+DELTA_FIELDS = ('id', 'cx', 'cy', 'w', 'h', 'conf', 'class_id', 'defect')
+BOX_SCALE = 10000
+CONF_SCALE = 1000
+
+def pack_rows(result):
+    """One packed row per prediction; ids are track ids when the result is tracked"""
+    predictions = result.get('predictions', [])
+    ids = result.get('track_ids') or list(range(1, len(predictions) + 1))
+    return [
+        [
+            track_id,
+            round(pred['center']['x'] * BOX_SCALE),
+            round(pred['center']['y'] * BOX_SCALE),
+            round(pred['width'] * BOX_SCALE),
+            round(pred['height'] * BOX_SCALE),
+            round(pred['confidence'] * CONF_SCALE),
+            pred.get('class_id', -1),
+            1 if pred.get('defect_status') == '缺陷' else 0
+        ]
+        for track_id, pred in zip(ids, predictions)
+    ]
+
+class DeltaEncoder:
+    """Compact realtime responses as changes against what the client already has.
+
+    Objects are packed rows (DELTA_FIELDS) keyed by stable track id. A keyframe
+    carries every object; other responses carry only added, updated and
+    removed objects relative to the previous response (base_seq). Clients that
+    miss a response resync by asking for a keyframe. Untracked results have no
+    stable ids, so they are always sent as keyframes.
+    """
+    def __init__(self, keyframe_interval=30, box_tolerance=0.002, conf_tolerance=0.05):
+        self.keyframe_interval = keyframe_interval
+        self.box_tolerance = round(box_tolerance * BOX_SCALE)
+        self.conf_tolerance = round(conf_tolerance * CONF_SCALE)
+        self.sent = {}
+        self.seq = 0
+        self.since_keyframe = None
+
+    def _changed(self, sent, row):
+        return (max(abs(a - b) for a, b in zip(sent[1:5], row[1:5])) > self.box_tolerance or
+                abs(sent[5] - row[5]) > self.conf_tolerance or
+                sent[6:] != row[6:])
+
+    def encode(self, result, resync=False):
+        rows = pack_rows(result)
+        self.seq += 1
+        keyframe = (resync or self.since_keyframe is None or 'track_ids' not in result or
+                    self.since_keyframe + 1 >= self.keyframe_interval)
+
+        message = {
+            'seq': self.seq,
+            'keyframe': keyframe,
+            'inference_time_ms': round(result.get('inference_time_ms', 0), 1),
+            'decode_time_ms': round(result.get('decode_time_ms', 0), 1),
+            'detected_objects': len(rows),
+            'reused': result.get('reused', False)
+        }
+
+        if keyframe:
+            message['fields'] = DELTA_FIELDS
+            message['classes'] = CLASS_NAMES_ZH.tolist()
+            message['objects'] = rows
+            self.sent = {row[0]: row for row in rows}
+            self.since_keyframe = 0
+            return message
+
+        current = {row[0]: row for row in rows}
+        added = [row for track_id, row in current.items() if track_id not in self.sent]
+        updated = [row for track_id, row in current.items()
+                   if track_id in self.sent and self._changed(self.sent[track_id], row)]
+        removed = [track_id for track_id in self.sent if track_id not in current]
+
+        for row in added + updated:
+            self.sent[row[0]] = row
+        for track_id in removed:
+            del self.sent[track_id]
+        self.since_keyframe += 1
+
+        message['base_seq'] = self.seq - 1
+        message['added'] = added
+        message['updated'] = updated
+        message['removed'] = removed
+        return message
+
+def create_delta_encoder(config=None):
+    config = config or REALTIME_CONFIG
+    return DeltaEncoder(
+        keyframe_interval=config['delta_keyframe_interval'],
+        box_tolerance=config['delta_box_tolerance'],
+        conf_tolerance=config['delta_conf_tolerance']
+    )
+
+def predict_gated(gate, image_data, predict):
+    if gate is None:
+        return dict(predict(image_data=image_data), reused=False)
+    return gate.run(image_data, predict)
+
+class RealtimeState:
+    """Per-client realtime state: duplicate-frame gate and object tracker.
+
+    Frames of one client are inferred one at a time, since each tracker update
+    depends on the previous one.
+    """
+    def __init__(self):
+        self.gate = create_gate()
+        self.tracker = create_realtime_tracker()
+        self.encoder = None
+        self.lock = threading.Lock()
+
+    def predict(self, image_data, predict):
+        """Result for one encoded frame; predict(image_data=..., tracker=...) runs inference"""
+        def run(image_data):
+            with self.lock:
+                return predict(image_data=image_data, tracker=self.tracker)
+        return predict_gated(self.gate, image_data, run)
+
+    def encode(self, result, encoding=None, resync=False):
+        """Response payload in the requested encoding: None for the full format, 'delta' for DeltaEncoder"""
+        if encoding != 'delta':
+            return format_realtime_result(result)
+        with self.lock:
+            if self.encoder is None:
+                self.encoder = create_delta_encoder()
+            return self.encoder.encode(result, resync)
+
+    def reused_frames(self):
+        return self.gate.reused_total if self.gate is not None else 0
+
+class StateRegistry:
+    """RealtimeStates of the stateless HTTP endpoint keyed by (user id, stream id), least recently used evicted"""
+    def __init__(self, max_sessions=256):
+        self.max_sessions = max_sessions
+        self.states = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            state = self.states.get(key)
+            if state is None:
+                state = self.states[key] = RealtimeState()
+                if len(self.states) > self.max_sessions:
+                    self.states.popitem(last=False)
+            else:
+                self.states.move_to_end(key)
+            return state
+
+http_states = StateRegistry(REALTIME_CONFIG['http_sessions'])
+
+class FrameMailbox:
+    """One-slot mailbox: put() replaces a frame that has not been taken yet"""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.item = None
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = item
+            self.condition.notify()
+
+    def get(self):
+        """Wait for the latest frame; None once closed"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.item is not None or self.closed)
+            item, self.item = self.item, None
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+class RealtimeSession:
+    """Inference loop for one realtime connection.
+
+    Frames from the client go into a one-slot mailbox; a session thread always
+    takes the newest frame, so frames that arrive while inference is busy are
+    dropped instead of queueing up. Each result is sent back tagged with the id
+    of the frame it belongs to. Near-duplicate frames reuse the previous
+    result and boxes keep their tracks' classifier results (RealtimeState).
+    """
+    def __init__(self, predict, send):
+        # predict(image_data=..., tracker=...) runs realtime inference on one encoded frame
+        self.predict = predict
+        self.send = send
+        self.mailbox = FrameMailbox()
+        self.state = RealtimeState()
+        self.processed = 0
+        self.encoding = None
+        self.resync = False
+        self.last_frame_time = time.time()
+        self.thread = threading.Thread(target=self._run, name='realtime-session', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, frame_id, image_data):
+        self.last_frame_time = time.time()
+        self.mailbox.put((frame_id, image_data, self.last_frame_time))
+
+    def set_encoding(self, encoding):
+        """Switch response encoding; switching to delta starts with a keyframe"""
+        self.encoding = encoding
+        self.resync = True
+
+    def request_resync(self):
+        self.resync = True
+
+    def idle_for(self):
+        return time.time() - self.last_frame_time
+
+    def close(self):
+        self.mailbox.close()
+        self.thread.join(timeout=5)
+
+    def stats(self):
+        return {
+            'processed_frames': self.processed,
+            'dropped_frames': self.mailbox.dropped,
+            'reused_frames': self.state.reused_frames()
+        }
+
+    def _run(self):
+        while True:
+            item = self.mailbox.get()
+            if item is None:
+                break
+            frame_id, image_data, received_at = item
+            try:
+                result = self.state.predict(image_data, self.predict)
+                self.processed += 1
+                resync, self.resync = self.resync, False
+                message = {
+                    'type': 'result',
+                    'frame_id': frame_id,
+                    'encoding': self.encoding or 'full',
+                    'data': self.state.encode(result, self.encoding, resync),
+                    'server_time_ms': round((time.time() - received_at) * 1000, 1),
+                    'dropped_frames': self.mailbox.dropped
+                }
+            except Exception as e:
+                print(f"实时检测帧处理失败: {e}")
+                message = {'type': 'error', 'frame_id': frame_id, 'message': f'无法处理帧: {str(e)}'}
+            try:
+                self.send(message)
+            except Exception:
+                # Connection closed while inferring; the handler ends the session
+                break
@@ -0,0 +1,306 @@
+import numpy as np
+import torch
+import time
+import uuid
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+from app.services.model_backend import BACKEND_CONFIG, load_model
+from app.services.preprocess import group_by_aspect_ratio, letterbox_batch, classify_batch
+from app.services.postprocess import Detections
+from app.services.annotation import create_renderer
+from app.services.pipeline import PROFILES, OUTPUT_CONFIG, InferencePipeline, StageContext, default_output, encode_image
+from app.services.video_engine import VideoEngine
+from app.services.video_io import (video_input, derived_path, remove_files, probe_video, open_video_writer,
+                                   build_video_result)
+from app.services.keyframes import create_selector
+from app.services.result_cache import weights_signature
+
+class ImageRecognitionWorker:
+    def __init__(self, backend=None, quantization=None, artifacts=None):
+        print("正在加载 AI 模型...")
+        start_time = time.time()
+        self._setup_optimization()
+        
+        model_start = time.time()
+        # Identifies the loaded weights for the result cache, even if the files change later
+        self.weights_signature = weights_signature([BACKEND_CONFIG['detector_weights'],
+                                                    BACKEND_CONFIG['classifier_weights']])
+        self.model1, self.model1_backend = load_model(BACKEND_CONFIG['detector_weights'], backend, quantization)
+        print(f"主模型加载完成 ({self.model1_backend}): {time.time() - model_start:.2f}s")
+        
+        model2_start = time.time()
+        self.model2, self.model2_backend = load_model(BACKEND_CONFIG['classifier_weights'], backend, quantization)
+        classify_imgsz = self.model2.overrides.get('imgsz') or 224
+        if isinstance(classify_imgsz, (list, tuple)):
+            classify_imgsz = classify_imgsz[0]
+        self.classify_imgsz = int(classify_imgsz)
+        print(f"子模型加载完成 ({self.model2_backend}): {time.time() - model2_start:.2f}s")
+        
+        self.renderer = create_renderer()
+        self.artifacts = artifacts
+        # Threads start on first submit, so creating this before the pool forks is safe
+        self.encode_executor = ThreadPoolExecutor(max_workers=OUTPUT_CONFIG['encode_threads'])
+        self.pipeline = InferencePipeline(self)
+        self.video_engine = VideoEngine(self)
+        print(f"模型初始化完成! 总耗时: {time.time() - start_time:.2f}s")
+    
+    def _setup_optimization(self):
+        self.device = torch.device('cpu')
+        print("正在使用 CPU")
+        torch.set_num_threads(min(4, torch.get_num_threads()))
+    
+    def draw_annotations(self, image, predictions):
+        return self.renderer.draw_pil(image, predictions)
+
+    def detect_batch(self, images, batch_size=8, scaleup=True, **predict_kwargs):
+        """Run the detector over images with one forward pass per aspect-ratio group.
+        
+        scaleup=False pads images smaller than the model input instead of upsampling them.
+
+        Returns one Detections per input image in original image coordinates, in the
+        same order as images, with time_ms set to its share of the group forward pass
+        and letterbox_ms to its share of the group letterbox.
+        """
+        detections = [None] * len(images)
+        
+        for group in group_by_aspect_ratio(images, batch_size):
+            letterbox_start = time.time()
+            group_images = [images[i] for i in group]
+            tensor, transforms = letterbox_batch(group_images, scaleup=scaleup)
+            group_start = time.time()
+            results = self.model1(tensor, save=False, verbose=False, **predict_kwargs)
+            group_time = (time.time() - group_start) * 1000
+            letterbox_time = (group_start - letterbox_start) * 1000
+            
+            for idx, img, (gain, pad_x, pad_y), result in zip(group, group_images, transforms, results):
+                det = Detections.from_boxes(result.boxes, img.width, img.height, group_time / len(group))
+                det.letterbox_ms = letterbox_time / len(group)
+                det.xyxy[:, [0, 2]] = ((det.xyxy[:, [0, 2]] - pad_x) / gain).clip(0, img.width)
+                det.xyxy[:, [1, 3]] = ((det.xyxy[:, [1, 3]] - pad_y) / gain).clip(0, img.height)
+                detections[idx] = det
+        
+        return detections
+
+    def classify_crops(self, crops, max_batch=32, crop_order='RGB'):
+        """Classify crop arrays (RGB, or BGR video frame slices) in stacked batches of up to max_batch.
+
+        Returns one dict per crop with subclass_id/subconfidence/defect_status.
+        """
+        outputs = []
+        
+        for start in range(0, len(crops), max_batch):
+            chunk = crops[start:start + max_batch]
+            try:
+                tensor = classify_batch(chunk, self.classify_imgsz, crop_order)
+                results = self.model2(tensor, save=False, verbose=False)
+                
+                for result in results:
+                    if getattr(result, 'probs', None) is not None:
+                        subclass_id = int(result.probs.top1)
+                        outputs.append({
+                            "subclass_id": subclass_id,
+                            "subconfidence": float(result.probs.top1conf),
+                            "defect_status": "缺陷" if subclass_id == 0 else "正常"
+                        })
+                    else:
+                        outputs.append({
+                            "subclass_id": None,
+                            "subconfidence": 0.0,
+                            "defect_status": "正常"
+                        })
+                        
+            except Exception as e:
+                print(f"Sub model batch inference failed: {e}")
+                outputs.extend({
+                    "subclass_id": None,
+                    "subconfidence": 0.0,
+                    "defect_status": "正常",
+                    "error": str(e)
+                } for _ in chunk)
+        
+        return outputs
+
+    def predict(self, img, return_annotated=False, realtime_mode=False, columnar=False):
+        profile = 'single_realtime' if realtime_mode else 'single'
+        ctx = self.pipeline.run([StageContext(img)], profile, annotate=return_annotated)[0]
+        
+        if return_annotated:
+            return {"annotated_image": ctx.encoded}
+        return self.pipeline.format_result(ctx, profile, columnar=columnar)
+
+    def predict_tiled(self, img, tile_size=None, overlap=None, batch_size=8, return_annotated=False, columnar=False):
+        """Sliced inference for high-resolution images.
+
+        Tiles (plus the full frame when configured) are detected as batches, boxes
+        are shifted back to full-image coordinates and seam duplicates are merged
+        before crop classification on the full-resolution image.
+        """
+        ctx = StageContext(img, tiling={'tile_size': tile_size, 'overlap': overlap})
+        self.pipeline.run([ctx], 'single', annotate=return_annotated, batch_size=batch_size)
+        return self.pipeline.format_result(ctx, 'single', columnar=columnar)
+
+    def process_video_segment(self, input_path, output_path, start_frame=0, end_frame=None, frame_interval=1,
+                              task_checker=None, progress_callback=None, keyframe_mode=None):
+        """Annotate frames [start_frame, end_frame) of input_path into output_path.
+
+        Returns the VideoEngine result plus keyframe selection stats; frame numbers
+        in the result buffer are absolute.
+        """
+        cap = cv2.VideoCapture(input_path)
+        out = None
+        try:
+            if not cap.isOpened():
+                raise ValueError("Cannot open video file")
+            
+            fps = int(cap.get(cv2.CAP_PROP_FPS))
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            if end_frame is None:
+                end_frame = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+                max_frames = None
+            else:
+                max_frames = end_frame - start_frame
+            if start_frame:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            
+            out = open_video_writer(output_path, fps, width, height)
+            selector = create_selector(keyframe_mode, frame_interval)
+            video_run = self.video_engine.run(
+                cap, out, fps, end_frame - start_frame,
+                frame_interval=frame_interval,
+                task_checker=task_checker,
+                progress_callback=progress_callback,
+                selector=selector,
+                start_frame=start_frame,
+                max_frames=max_frames
+            )
+            video_run['keyframe_selection'] = selector.stats()
+            return video_run
+        finally:
+            cap.release()
+            if out is not None:
+                out.release()
+
+    def process_video_with_annotation(self, video_file, frame_interval=2, task_checker=None, progress_callback=None,
+                                      keyframe_mode=None):
+        """Annotate a whole video given as a file path or file object"""
+        start_time = time.time()
+        
+        with video_input(video_file) as input_path:
+            temp_output_path = derived_path(input_path, f'_annotated_{uuid.uuid4().hex[:8]}')
+            try:
+                info = probe_video(input_path)
+                video_run = self.process_video_segment(
+                    input_path, temp_output_path,
+                    frame_interval=frame_interval,
+                    task_checker=task_checker,
+                    progress_callback=progress_callback,
+                    keyframe_mode=keyframe_mode
+                )
+                return build_video_result(info, [video_run], temp_output_path, frame_interval, start_time, self.artifacts)
+                
+            except Exception as e:
+                raise Exception(f"Video processing failed: {str(e)}")
+            finally:
+                remove_files(temp_output_path)
+
+    def batch_predict_images(self, images, return_annotated=False, batch_size=8, tiling=None,
+                             output=None, image_data_list=None, task_checker=None, progress_callback=None):
+        """Batched predictions; annotation/encoding of one batch overlaps inference of the next.
+        
+        progress_callback(done, total) runs as results complete, in order. Once
+        task_checker() returns True no further batch starts and only the finished
+        results are returned.
+        """
+        if not images:
+            return []
+        
+        output = output or default_output()
+        image_data_list = image_data_list or [None] * len(images)
+        entries = []
+        all_results = []
+        
+        def collect(wait):
+            # Finish results in order; without wait, stop at the first encode still running
+            while len(all_results) < len(entries):
+                entry, future = entries[len(all_results)]
+                if future is not None:
+                    if not wait and not future.done():
+                        return
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"Encode annotated image failed: {e}")
+                all_results.append(entry if isinstance(entry, dict) else self.pipeline.format_result(entry, 'batch'))
+                if progress_callback:
+                    progress_callback(len(all_results), len(images))
+        
+        for batch_idx in range(0, len(images), batch_size):
+            if task_checker and task_checker():
+                break
+            batch_images = images[batch_idx:batch_idx + batch_size]
+            batch_data = image_data_list[batch_idx:batch_idx + batch_size]
+            
+            try:
+                contexts = [StageContext(img, image_data=data, tiling=tiling)
+                            for img, data in zip(batch_images, batch_data)]
+                self.pipeline.run(contexts, 'batch', annotate=False, batch_size=batch_size)
+                for ctx in contexts:
+                    future = self.encode_executor.submit(self.pipeline.render_output, ctx, output) if return_annotated else None
+                    entries.append((ctx, future))
+                
+            except Exception as e:
+                print(f"Batch processing failed: {e}")
+                for img in batch_images:
+                    result_data = {
+                        "predictions": [],
+                        "inference_time_ms": 0,
+                        "detected_objects": 0,
+                        "error": str(e)
+                    }
+                    if return_annotated:
+                        result_data["annotated_image"] = encode_image(img, self.artifacts, **output)
+                    entries.append((result_data, None))
+            
+            collect(wait=False)
+        
+        collect(wait=True)
+        return all_results
+
+    def _realtime_profile(self, min_confidence):
+        profile = PROFILES['realtime']
+        if min_confidence != profile['min_confidence']:
+            profile = dict(profile, min_confidence=min_confidence,
+                           detect_args=dict(profile['detect_args'], conf=min_confidence))
+        return profile
+
+    def predict_realtime(self, img=None, min_confidence=0.3, image_data=None):
+        """Realtime prediction of a decoded image, or of encoded bytes (decoded in reduced-size draft mode)"""
+        profile = self._realtime_profile(min_confidence)
+        
+        # Normalized coordinates are identical for the resized and original frame
+        ctx = self.pipeline.run([StageContext(img, image_data=image_data)], profile)[0]
+        return self.pipeline.format_result(ctx, profile)
+
+    def predict_realtime_tracked(self, tracker, img=None, min_confidence=0.3, image_data=None):
+        """predict_realtime that classifies only new, moved or stale tracks of a session's IoUTracker.
+
+        Other boxes reuse their track's last classifier result. Returns
+        (result, tracker) so the updated tracker also comes back from a pool process.
+        """
+        profile = dict(self._realtime_profile(min_confidence), classify=False)
+        ctx = self.pipeline.run([StageContext(img, image_data=image_data)], profile)[0]
+        
+        classify_start = time.time()
+        tracks, to_classify = tracker.update(ctx.detections, tracker.keyframe_count + 1)
+        if to_classify:
+            selected = ctx.detections.filter(np.array(to_classify, dtype=int))
+            for i, sub_result in zip(to_classify, self.classify_crops(selected.crops(np.asarray(ctx.image)))):
+                tracks[i].set_sub_result(sub_result)
+        ctx.sub_results = [tracker.sub_result(track) for track in tracks]
+        ctx.timings['classify'] = (time.time() - classify_start) * 1000
+        
+        result = self.pipeline.format_result(ctx, profile)
+        result['classified_objects'] = len(to_classify)
+        result['track_ids'] = [track.id for track in tracks]
+        return result, tracker
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+# Inference result cache
+# disk_dir: directory of the on-disk tier, None keeps results in memory only
+CACHE_CONFIG = {
+    'enabled': True,
+    'memory_entries': 256,
+    'memory_bytes': 256 * 1024 * 1024,
+    'disk_dir': 'result_cache',
+    'disk_entries': 5000
+}
+
+# Per-request fields that must not be replayed from the cache
+VOLATILE_FIELDS = ('queue_wait_ms', 'batch_size')
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def weights_signature(model_files):
+    """(path, size, mtime) of each weight file; taken when the models are loaded"""
+    signature = []
+    for path in model_files:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_size, int(stat.st_mtime)))
+        except OSError:
+            signature.append((path, None, None))
+    return signature
+
+class ResultCache:
+    """Content-addressed prediction cache with a memory LRU and optional disk tier.
+
+    Keys combine the image hash, the model version and the inference parameters.
+    The model version is the weights signature of the models actually loaded, so
+    entries stay valid until the process restarts with new weights; disk entries
+    of other versions are removed at startup.
+    """
+    def __init__(self, model_files, model_signature, version_tag='', memory_entries=256, memory_bytes=None,
+                 disk_dir=None, disk_entries=5000):
+        self.model_files = list(model_files)
+        self.model_signature = model_signature
+        self.version_tag = version_tag
+        self.memory_entries = memory_entries
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_entries = disk_entries
+
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.disk_count = 0
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0
+        }
+
+        self.version = hash_bytes(json.dumps([model_signature, version_tag]).encode('utf-8'))[:16]
+        if self.disk_dir:
+            os.makedirs(self._version_dir(), exist_ok=True)
+            for name in os.listdir(self.disk_dir):
+                path = os.path.join(self.disk_dir, name)
+                if name != self.version and os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+            self.disk_count = len(os.listdir(self._version_dir()))
+
+    def _version_dir(self):
+        return os.path.join(self.disk_dir, self.version)
+
+    def make_key(self, image_data, **params):
+        """Cache key for raw image bytes and the inference parameters"""
+        params_text = json.dumps(params, sort_keys=True)
+        return f"{hash_bytes(image_data)}-{hash_bytes(params_text.encode('utf-8'))[:16]}"
+
+    def _disk_path(self, key):
+        return os.path.join(self._version_dir(), f"{key}.json")
+
+    def _remember(self, key, payload):
+        # Caller holds self.lock
+        if key in self.memory:
+            self.memory_size -= len(self.memory.pop(key))
+        self.memory[key] = payload
+        self.memory_size += len(payload)
+
+        while self.memory and (len(self.memory) > self.memory_entries or
+                               (self.memory_bytes and self.memory_size > self.memory_bytes)):
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= len(evicted)
+            self.counters['memory_evictions'] += 1
+
+    def get(self, key):
+        """Return a fresh copy of the cached result, or None on a miss"""
+        with self.lock:
+            payload = self.memory.get(key)
+            if payload is not None:
+                self.memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return json.loads(payload)
+
+        if self.disk_dir:
+            try:
+                path = self._disk_path(key)
+                with open(path, 'rb') as f:
+                    payload = f.read()
+                # Eviction goes by mtime: touch on a hit so the disk tier is LRU, not FIFO
+                os.utime(path, None)
+                with self.lock:
+                    self._remember(key, payload)
+                    self.counters['disk_hits'] += 1
+                return json.loads(payload)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Read result cache failed: {e}")
+
+        with self.lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, key, result):
+        stored = {k: v for k, v in result.items() if k not in VOLATILE_FIELDS}
+        payload = json.dumps(stored, ensure_ascii=False).encode('utf-8')
+
+        with self.lock:
+            self._remember(key, payload)
+
+        if self.disk_dir:
+            try:
+                path = self._disk_path(key)
+                existed = os.path.exists(path)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)
+                if not existed:
+                    with self.lock:
+                        self.disk_count += 1
+                    self._evict_disk()
+            except Exception as e:
+                print(f"Write result cache failed: {e}")
+
+    def _evict_disk(self):
+        if self.disk_count <= self.disk_entries:
+            return
+
+        version_dir = self._version_dir()
+        entries = []
+        for name in os.listdir(version_dir):
+            path = os.path.join(version_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+
+        # Trim to 90% so eviction does not run on every insert
+        excess = len(entries) - int(self.disk_entries * 0.9)
+        for _, path in sorted(entries)[:max(0, excess)]:
+            try:
+                os.unlink(path)
+                with self.lock:
+                    self.counters['disk_evictions'] += 1
+            except OSError:
+                pass
+
+        with self.lock:
+            self.disk_count = len(os.listdir(version_dir))
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_size = 0
+            if self.disk_dir:
+                shutil.rmtree(self._version_dir(), ignore_errors=True)
+                os.makedirs(self._version_dir(), exist_ok=True)
+                self.disk_count = 0
+
+    def stats(self):
+        # Weights replaced on disk only take effect (and change the version) after a restart
+        weights_changed = weights_signature(self.model_files) != self.model_signature
+        with self.lock:
+            lookups = self.counters['memory_hits'] + self.counters['disk_hits'] + self.counters['misses']
+            hits = self.counters['memory_hits'] + self.counters['disk_hits']
+            return dict(
+                self.counters,
+                hit_rate=round(hits / lookups, 4) if lookups else 0.0,
+                memory_entries=len(self.memory),
+                memory_bytes=self.memory_size,
+                disk_entries=self.disk_count if self.disk_dir else 0,
+                model_version=self.version,
+                weights_changed_on_disk=weights_changed
+            )
+
+def mark_cache_hit(result, lookup_ms):
+    """Rewrite timing fields of a cached result to show it was not recomputed"""
+    result['cache_hit'] = True
+    result['original_inference_time_ms'] = result.get('inference_time_ms', 0)
+    result['inference_time_ms'] = lookup_ms
+    result['cache_lookup_ms'] = lookup_ms
+    for field in ('main_model_time_ms', 'sub_model_time_ms', 'crop_time_ms'):
+        if field in result:
+            result[field] = 0
+    return result
+
+def create_cache(model_files, model_signature, version_tag='', config=None):
+    """Build a ResultCache from config, or None when caching is disabled"""
+    config = config or CACHE_CONFIG
+    if not config['enabled']:
+        return None
+    return ResultCache(
+        model_files,
+        model_signature,
+        version_tag=version_tag,
+        memory_entries=config['memory_entries'],
+        memory_bytes=config['memory_bytes'],
+        disk_dir=config['disk_dir'],
+        disk_entries=config['disk_entries']
+    )
+
+def timed_lookup(cache, key):
+    """get() plus the lookup time in milliseconds"""
+    lookup_start = time.time()
+    result = cache.get(key)
+    return result, (time.time() - lookup_start) * 1000
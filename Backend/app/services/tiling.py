@@ -0,0 +1,99 @@
+import numpy as np
+
+# Sliced inference defaults for high-resolution imagery
+TILING_CONFIG = {
+    'tile_size': 1024,
+    'overlap': 0.2,
+    'include_full_frame': True,
+    'merge_iou': 0.5,
+    'merge_ios': 0.8,
+    'min_tile_size': 320,
+    'max_tile_size': 4096,
+    'max_overlap': 0.5
+}
+
+def _axis_starts(length, tile, step):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile + 1, step))
+    if starts[-1] + tile < length:
+        starts.append(length - tile)
+    return starts
+
+def tile_grid(width, height, tile_size, overlap):
+    """(x, y, w, h) tiles covering the image with the given fractional overlap"""
+    step = max(1, int(tile_size * (1 - overlap)))
+    tile_w = min(tile_size, width)
+    tile_h = min(tile_size, height)
+    return [
+        (x, y, tile_w, tile_h)
+        for y in _axis_starts(height, tile_h, step)
+        for x in _axis_starts(width, tile_w, step)
+    ]
+
+def merge_detections(xyxy, conf, cls, iou_threshold=0.5, ios_threshold=0.8):
+    """Class-aware greedy NMS that fuses duplicates across tile seams.
+
+    A box is merged into a higher-confidence box of the same class when their IoU
+    exceeds iou_threshold or when it lies mostly inside it (intersection over the
+    smaller box above ios_threshold), which catches objects cut by a tile edge.
+    The kept box grows to the union of everything merged into it.
+    Returns merged (xyxy, conf, cls) arrays.
+    """
+    if len(xyxy) == 0:
+        return xyxy, conf, cls
+
+    order = np.argsort(-conf)
+    xyxy, conf, cls = xyxy[order].copy(), conf[order], cls[order]
+    areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    alive = np.ones(len(xyxy), dtype=bool)
+    keep = []
+
+    for i in range(len(xyxy)):
+        if not alive[i]:
+            continue
+        keep.append(i)
+        rest = np.nonzero(alive)[0]
+        rest = rest[(rest > i) & (cls[rest] == cls[i])]
+        if len(rest) == 0:
+            continue
+
+        ix1 = np.maximum(xyxy[i, 0], xyxy[rest, 0])
+        iy1 = np.maximum(xyxy[i, 1], xyxy[rest, 1])
+        ix2 = np.minimum(xyxy[i, 2], xyxy[rest, 2])
+        iy2 = np.minimum(xyxy[i, 3], xyxy[rest, 3])
+        inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        ios = inter / np.maximum(np.minimum(areas[i], areas[rest]), 1e-9)
+
+        merged = rest[(iou > iou_threshold) | (ios > ios_threshold)]
+        if len(merged):
+            alive[merged] = False
+            xyxy[i, :2] = np.minimum(xyxy[i, :2], xyxy[merged, :2].min(axis=0))
+            xyxy[i, 2:] = np.maximum(xyxy[i, 2:], xyxy[merged, 2:].max(axis=0))
+            areas[i] = (xyxy[i, 2] - xyxy[i, 0]) * (xyxy[i, 3] - xyxy[i, 1])
+
+    keep = np.array(keep, dtype=int)
+    return xyxy[keep], conf[keep], cls[keep]
+
+def parse_tiling_options(values):
+    """Validate per-request tiling options from a form/query mapping.
+
+    Returns None when tiling is not requested, otherwise a kwargs dict for
+    predict_tiled. Raises ValueError with a user-facing message on bad input.
+    """
+    if str(values.get('tiled', '')).lower() not in ('1', 'true', 'yes', 'on'):
+        return None
+
+    try:
+        tile_size = int(values.get('tile_size', TILING_CONFIG['tile_size']))
+        overlap = float(values.get('tile_overlap', TILING_CONFIG['overlap']))
+    except (TypeError, ValueError):
+        raise ValueError('切片参数格式错误')
+
+    if not TILING_CONFIG['min_tile_size'] <= tile_size <= TILING_CONFIG['max_tile_size']:
+        raise ValueError(f"切片大小需在 {TILING_CONFIG['min_tile_size']}-{TILING_CONFIG['max_tile_size']} 之间")
+    if not 0 <= overlap <= TILING_CONFIG['max_overlap']:
+        raise ValueError(f"切片重叠比例需在 0-{TILING_CONFIG['max_overlap']} 之间")
+
+    return {'tile_size': tile_size, 'overlap': overlap}
@@ -0,0 +1,223 @@
+import numpy as np
+from app.services.postprocess import CLASS_MAPPING, DEFAULT_SUB_RESULT, Detections
+
+# Multi-object tracking across video keyframes
+# max_missed: keyframes a track survives without a matching detection
+# classify_refresh: keyframes after which a track's defect status is re-classified, 0 never
+# alpha/beta: gains of the constant-velocity (alpha-beta) box filter
+TRACKING_CONFIG = {
+    'enabled': True,
+    'iou_threshold': 0.3,
+    'max_missed': 3,
+    'min_hits': 1,
+    'classify_refresh': 10,
+    'alpha': 0.6,
+    'beta': 0.2
+}
+
+def iou_matrix(a, b):
+    """Pairwise IoU between (N, 4) and (M, 4) xyxy arrays"""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    ix1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    iy2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+class Track:
+    def __init__(self, track_id, xyxy, conf, cls, frame_index):
+        self.id = track_id
+        self.xyxy = xyxy.astype(np.float32)
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.conf = float(conf)
+        self.cls = int(cls)
+        self.last_frame = frame_index
+        self.hits = 1
+        self.missed = 0
+        self.sub_result = None
+        self.classified_at = None
+        self.classified_xyxy = None
+        self.ever_defect = False
+
+    def predict(self, frame_index):
+        return self.xyxy + self.velocity * (frame_index - self.last_frame)
+
+    def set_sub_result(self, sub_result):
+        self.sub_result = sub_result
+        if sub_result.get('defect_status') == '缺陷':
+            self.ever_defect = True
+
+class Snapshot:
+    """Observed tracks at one keyframe, used to draw boxes on the frames around it"""
+    def __init__(self, frame_index, tracks, width, height):
+        self.frame_index = frame_index
+        self.tracks = tracks
+        self.ids = np.array([t.id for t in tracks], dtype=int)
+        self.xyxy = np.array([t.xyxy for t in tracks], dtype=np.float32).reshape(-1, 4)
+        self.velocity = np.array([t.velocity for t in tracks], dtype=np.float32).reshape(-1, 4)
+        self.conf = np.array([t.conf for t in tracks], dtype=np.float32)
+        self.cls = np.array([t.cls for t in tracks], dtype=int)
+        self.width = width
+        self.height = height
+
+class IoUTracker:
+    """Greedy IoU tracker with an alpha-beta box filter, updated on keyframes only.
+
+    Detections are matched to the predicted positions of live tracks of the same
+    class. Each track is classified when it is created and again every
+    classify_refresh keyframes, instead of classifying every box on every
+    keyframe. Boxes for frames between keyframes come from interpolate().
+    With reclassify_iou set, a track is also re-classified once its box overlaps
+    the box it was classified at by less than that IoU. keep_finished=False
+    drops ended tracks instead of keeping them for summary(), for long-lived
+    realtime sessions.
+    """
+    def __init__(self, iou_threshold=0.3, max_missed=3, min_hits=1, classify_refresh=10, alpha=0.6, beta=0.2,
+                 reclassify_iou=None, keep_finished=True):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.min_hits = min_hits
+        self.classify_refresh = classify_refresh
+        self.alpha = alpha
+        self.beta = beta
+        self.reclassify_iou = reclassify_iou
+        self.keep_finished = keep_finished
+        self.tracks = []
+        self.finished = []
+        self.next_id = 1
+        self.keyframe_count = 0
+
+    def _needs_classification(self, track):
+        if track.classified_at is None:
+            return True
+        if self.reclassify_iou is not None:
+            moved = iou_matrix(track.xyxy[None], track.classified_xyxy[None])[0, 0] < self.reclassify_iou
+            if moved:
+                return True
+        return bool(self.classify_refresh) and self.keyframe_count - track.classified_at >= self.classify_refresh
+
+    def update(self, detections, frame_index):
+        """Match one keyframe's Detections to tracks.
+
+        Returns (track_per_detection, to_classify) where to_classify lists the
+        detection indices whose tracks need a (new) classifier result.
+        """
+        self.keyframe_count += 1
+        predicted = np.array([t.predict(frame_index) for t in self.tracks], dtype=np.float32).reshape(-1, 4)
+        ious = iou_matrix(predicted, detections.xyxy)
+        if ious.size:
+            same_class = np.array([t.cls for t in self.tracks])[:, None] == detections.cls[None, :]
+            ious = np.where(same_class, ious, 0)
+
+        assigned = [None] * len(detections)
+        matched_tracks = set()
+        if ious.size:
+            for flat in np.argsort(-ious, axis=None):
+                t_idx, d_idx = np.unravel_index(flat, ious.shape)
+                if ious[t_idx, d_idx] < self.iou_threshold:
+                    break
+                if t_idx in matched_tracks or assigned[d_idx] is not None:
+                    continue
+                matched_tracks.add(t_idx)
+                assigned[d_idx] = self.tracks[t_idx]
+
+                track = self.tracks[t_idx]
+                dt = max(1, frame_index - track.last_frame)
+                residual = detections.xyxy[d_idx] - predicted[t_idx]
+                track.xyxy = predicted[t_idx] + self.alpha * residual
+                track.velocity = track.velocity + self.beta * residual / dt
+                track.conf = float(detections.conf[d_idx])
+                track.last_frame = frame_index
+                track.hits += 1
+                track.missed = 0
+
+        for t_idx, track in enumerate(self.tracks):
+            if t_idx not in matched_tracks:
+                track.missed += 1
+
+        for d_idx in range(len(detections)):
+            if assigned[d_idx] is None:
+                track = Track(self.next_id, detections.xyxy[d_idx], detections.conf[d_idx],
+                              detections.cls[d_idx], frame_index)
+                self.next_id += 1
+                self.tracks.append(track)
+                assigned[d_idx] = track
+
+        alive = []
+        for track in self.tracks:
+            if track.missed <= self.max_missed:
+                alive.append(track)
+            elif self.keep_finished:
+                self.finished.append(track)
+        self.tracks = alive
+
+        to_classify = [i for i, track in enumerate(assigned) if self._needs_classification(track)]
+        for i in to_classify:
+            # Marked now so later keyframes of the same batch do not queue the track again
+            assigned[i].classified_at = self.keyframe_count
+            assigned[i].classified_xyxy = assigned[i].xyxy.copy()
+        return assigned, to_classify
+
+    def snapshot(self, frame_index, width, height):
+        return Snapshot(frame_index, [t for t in self.tracks if t.missed == 0], width, height)
+
+    def interpolate(self, previous, following, frame_index):
+        """(Detections, sub_results) for a frame between two keyframe snapshots.
+
+        Tracks seen at both keyframes are interpolated linearly, tracks only in
+        previous are extrapolated with their velocity, tracks that first appear
+        in following are not drawn yet.
+        """
+        if previous is None:
+            return None
+        if frame_index == previous.frame_index:
+            xyxy = previous.xyxy
+        else:
+            xyxy = previous.xyxy + previous.velocity * (frame_index - previous.frame_index)
+            if following is not None and len(previous.ids) and len(following.ids):
+                t = (frame_index - previous.frame_index) / (following.frame_index - previous.frame_index)
+                positions = {track_id: i for i, track_id in enumerate(following.ids.tolist())}
+                for i, track_id in enumerate(previous.ids.tolist()):
+                    j = positions.get(track_id)
+                    if j is not None:
+                        xyxy[i] = previous.xyxy[i] + (following.xyxy[j] - previous.xyxy[i]) * t
+
+        detections = Detections(xyxy, previous.conf, previous.cls, previous.width, previous.height)
+        return detections, [self.sub_result(t) for t in previous.tracks]
+
+    def sub_result(self, track):
+        return dict(track.sub_result or DEFAULT_SUB_RESULT, track_id=track.id)
+
+    def summary(self):
+        """Counts of unique tracked objects"""
+        tracks = [t for t in self.finished + self.tracks if t.hits >= self.min_hits]
+        detected_classes = {}
+        for track in tracks:
+            class_name = CLASS_MAPPING.get(track.cls, f"unknown_class_{track.cls}")
+            detected_classes[class_name] = detected_classes.get(class_name, 0) + 1
+        defect_objects = sum(1 for t in tracks if t.ever_defect)
+        return {
+            'unique_objects': len(tracks),
+            'detected_classes': detected_classes,
+            'defect_objects': defect_objects,
+            'normal_objects': len(tracks) - defect_objects,
+            'classified_tracks': sum(1 for t in tracks if t.classified_at is not None)
+        }
+
+def create_tracker(config=None):
+    """Build an IoUTracker from config, or None when tracking is disabled"""
+    config = config or TRACKING_CONFIG
+    if not config['enabled']:
+        return None
+    return IoUTracker(
+        iou_threshold=config['iou_threshold'],
+        max_missed=config['max_missed'],
+        min_hits=config['min_hits'],
+        classify_refresh=config['classify_refresh'],
+        alpha=config['alpha'],
+        beta=config['beta']
+    )
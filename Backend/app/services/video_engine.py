@@ -0,0 +1,290 @@
+import threading
+import time
+from queue import Queue, Full
+import numpy as np
+from app.services.pipeline import INFERENCE_STAGES, StageContext
+from app.services.preprocess import FrameView
+from app.services.keyframes import FixedIntervalSelector
+from app.services.tracking import create_tracker
+from app.services.video_results import VIDEO_RESULTS_CONFIG, FrameResultBuffer
+
+# Staged video processing
+# keyframe_batch_size: keyframes sent through the detector together
+# max_pending_frames: frames held while a keyframe batch fills, bounds memory
+# segment_parallel: with a process pool, split videos into frame ranges of at least
+#                   min_segment_frames and process them in separate processes
+VIDEO_CONFIG = {
+    'frame_queue_size': 32,
+    'write_queue_size': 32,
+    'keyframe_batch_size': 4,
+    'max_pending_frames': 64,
+    'segment_parallel': True,
+    'min_segment_frames': 900
+}
+
+_END = object()
+
+def _put(queue, item, stop):
+    """Blocking put that gives up once stop is set; returns False if the item was dropped"""
+    while True:
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            if stop.is_set():
+                return False
+
+class FramePool:
+    """Reusable BGR frame buffers for the decoder.
+
+    cap.read() decodes into a released buffer instead of allocating a new frame,
+    so after warm-up the video loop allocates no full-size arrays. Buffers are
+    created on demand up to max_frames; acquire blocks while all are in flight.
+    """
+    def __init__(self, max_frames):
+        self.max_frames = max_frames
+        self.free = []
+        self.allocated = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, stop):
+        """A free buffer, None to let cap.read() allocate one, or False once stop is set"""
+        with self.condition:
+            while not self.free and self.allocated >= self.max_frames:
+                if stop.is_set():
+                    return False
+                self.condition.wait(0.1)
+            if self.free:
+                return self.free.pop()
+            self.allocated += 1
+            return None
+
+    def release(self, frame):
+        with self.condition:
+            self.free.append(frame)
+            self.condition.notify()
+
+class VideoEngine:
+    """Decode -> keyframe inference -> annotate/encode, each in its own thread.
+
+    A decoder thread fills a bounded frame queue, the calling thread batches
+    keyframes through the inference pipeline, and a writer thread draws the
+    latest keyframe result onto every frame and writes them in order. Queues
+    are bounded so a slow stage applies backpressure instead of buffering the
+    whole video. Every stage drains its input up to the end marker, so a
+    failure or cancellation in one stage never leaves another blocked.
+
+    Frames stay in the BGR buffers cap.read() decoded them into: the detector
+    and classifier get views of them (see preprocess.FrameView), boxes are
+    drawn in place and the same buffer is written and then reused.
+    """
+    def __init__(self, model_worker, config=None):
+        self.worker = model_worker
+        self.config = config or VIDEO_CONFIG
+
+    def run(self, cap, writer, fps, total_frames, frame_interval=1, task_checker=None, progress_callback=None,
+            selector=None, start_frame=0, max_frames=None):
+        """Process every frame of cap into writer.
+
+        selector decides which frames go through the detector (see keyframes.py);
+        without one every frame_interval-th frame does. Keyframe selection runs in
+        the decoder thread so it overlaps inference. cap must already be positioned
+        at start_frame; at most max_frames frames are read when it is set.
+        With tracking enabled, keyframe boxes feed an IoUTracker: boxes on the
+        frames in between are interpolated from the tracks and each track is
+        classified once (plus periodic refreshes).
+        Returns a dict with results (a FrameResultBuffer holding every keyframe's
+        boxes, in order), processed_frames, written_frames and, when tracking, a
+        unique-object summary.
+        """
+        selector = selector or FixedIntervalSelector(frame_interval)
+        stop = threading.Event()
+        frame_queue = Queue(maxsize=self.config['frame_queue_size'])
+        write_queue = Queue(maxsize=self.config['write_queue_size'])
+        # Every frame in flight: both queues, the pending batch and one per thread
+        pool = FramePool(self.config['frame_queue_size'] + self.config['write_queue_size'] +
+                         self.config['max_pending_frames'] + 3)
+        errors = []
+        written = [0]
+
+        def decode():
+            try:
+                index = start_frame
+                while not stop.is_set():
+                    if max_frames is not None and index - start_frame >= max_frames:
+                        break
+                    buffer = pool.acquire(stop)
+                    if buffer is False:
+                        break
+                    ret, frame = cap.read(buffer)
+                    if not ret:
+                        break
+                    is_keyframe = selector.is_keyframe(index, frame)
+                    if not _put(frame_queue, (index, frame, is_keyframe), stop):
+                        break
+                    index += 1
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                frame_queue.put(_END)
+
+        def write():
+            while True:
+                item = write_queue.get()
+                if item is _END:
+                    break
+                if errors:
+                    continue
+                try:
+                    _, frame, detection = item
+                    if detection is not None:
+                        self.worker.renderer.draw_detections(frame, *detection, color_order='BGR')
+                    writer.write(frame)
+                    pool.release(frame)
+                    written[0] += 1
+                    if progress_callback:
+                        progress_callback(written[0], total_frames)
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+
+        decoder = threading.Thread(target=decode, name='video-decode', daemon=True)
+        encoder = threading.Thread(target=write, name='video-encode', daemon=True)
+        decoder.start()
+        encoder.start()
+
+        state = {
+            'pending': [],
+            'keyframes': [],
+            'last_detection': None,
+            'snapshot': None,
+            'tracker': create_tracker(),
+            'results': FrameResultBuffer(VIDEO_RESULTS_CONFIG['initial_capacity'])
+        }
+        ended = False
+
+        try:
+            while True:
+                item = frame_queue.get()
+                if item is _END:
+                    ended = True
+                    break
+                if stop.is_set():
+                    continue
+                if task_checker and task_checker():
+                    stop.set()
+                    continue
+
+                index, frame, is_keyframe = item
+                state['pending'].append((index, frame))
+                if is_keyframe:
+                    state['keyframes'].append((index, frame))
+
+                if (len(state['keyframes']) >= self.config['keyframe_batch_size'] or
+                        len(state['pending']) >= self.config['max_pending_frames']):
+                    self._flush(state, fps, write_queue, stop)
+
+            if not stop.is_set():
+                self._flush(state, fps, write_queue, stop)
+
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+            while not ended:
+                ended = frame_queue.get() is _END
+        finally:
+            write_queue.put(_END)
+            decoder.join()
+            encoder.join()
+
+        if errors:
+            raise errors[0]
+
+        result = {
+            'results': state['results'],
+            'processed_frames': state['results'].frames.size,
+            'written_frames': written[0]
+        }
+        if state['tracker'] is not None:
+            result['tracking'] = state['tracker'].summary()
+        return result
+
+    def _record(self, state, ctx, index, fps, classified_objects=None):
+        state['results'].add_keyframe(
+            index,
+            index / fps if fps > 0 else 0,
+            ctx.detections,
+            ctx.sub_results,
+            sum(ctx.timings.get(stage, 0) for stage in INFERENCE_STAGES),
+            classified_objects
+        )
+
+    def _flush(self, state, fps, write_queue, stop):
+        """Run the queued keyframes as one batch and hand all pending frames to the writer"""
+        if state['tracker'] is not None:
+            return self._flush_tracked(state, fps, write_queue, stop)
+
+        keyed = {}
+        keyframes = state['keyframes']
+        if keyframes:
+            contexts = [StageContext(FrameView(frame)) for _, frame in keyframes]
+            self.worker.pipeline.run(contexts, 'video_keyframe', batch_size=len(contexts))
+
+            for (index, _), ctx in zip(keyframes, contexts):
+                self._record(state, ctx, index, fps)
+                keyed[index] = (ctx.detections, ctx.sub_results)
+
+        for index, frame in state['pending']:
+            if index in keyed:
+                state['last_detection'] = keyed[index]
+            if not _put(write_queue, (index, frame, state['last_detection']), stop):
+                break
+
+        state['pending'] = []
+        state['keyframes'] = []
+
+    def _flush_tracked(self, state, fps, write_queue, stop):
+        tracker = state['tracker']
+        keyframes = state['keyframes']
+        snapshots = []
+
+        if keyframes:
+            contexts = [StageContext(FrameView(frame)) for _, frame in keyframes]
+            self.worker.pipeline.run(contexts, 'video_tracked', batch_size=len(contexts))
+
+            assignments = []
+            jobs = []
+            for (index, _), ctx in zip(keyframes, contexts):
+                tracks, to_classify = tracker.update(ctx.detections, index)
+                assignments.append((tracks, len(to_classify)))
+                if to_classify:
+                    selected = ctx.detections.filter(np.array(to_classify, dtype=int))
+                    jobs.extend(zip([tracks[i] for i in to_classify], selected.crops(np.asarray(ctx.image))))
+                snapshots.append(tracker.snapshot(index, ctx.image.width, ctx.image.height))
+
+            classify_start = time.time()
+            if jobs:
+                for (track, _), sub_result in zip(jobs, self.worker.classify_crops([crop for _, crop in jobs], crop_order='BGR')):
+                    track.set_sub_result(sub_result)
+            classify_time = (time.time() - classify_start) * 1000 / len(contexts)
+
+            for (index, _), ctx, (tracks, classified) in zip(keyframes, contexts, assignments):
+                ctx.sub_results = [tracker.sub_result(track) for track in tracks]
+                ctx.timings['classify'] = classify_time
+                self._record(state, ctx, index, fps, classified)
+
+        previous = state['snapshot']
+        next_snapshot = 0
+        for index, frame in state['pending']:
+            while next_snapshot < len(snapshots) and snapshots[next_snapshot].frame_index <= index:
+                previous = snapshots[next_snapshot]
+                next_snapshot += 1
+            following = snapshots[next_snapshot] if next_snapshot < len(snapshots) else None
+            detection = tracker.interpolate(previous, following, index)
+            if not _put(write_queue, (index, frame, detection), stop):
+                break
+
+        state['snapshot'] = previous
+        state['pending'] = []
+        state['keyframes'] = []
@@ -0,0 +1,251 @@
+import base64
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+import cv2
+from app.services.video_results import VIDEO_RESULTS_CONFIG, SIDECAR_EXTENSIONS, FrameResultBuffer
+
+FOURCC_OPTIONS = ('H264', 'avc1', 'mp4v', 'XVID')
+
+def write_temp_video(video_file, chunk_size=1024 * 1024):
+    """Copy an uploaded video file object to a temp .mp4 in chunks and return its path"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_input_file:
+        video_file.seek(0)
+        shutil.copyfileobj(video_file, temp_input_file, chunk_size)
+        return temp_input_file.name
+
+@contextmanager
+def video_input(video_file):
+    """Local path of a video given as a path or a file object.
+
+    Paths (e.g. uploads already spooled to disk) are used as-is and left to the
+    caller; file objects are copied to a temp file that is removed afterwards.
+    """
+    if isinstance(video_file, str):
+        yield video_file
+        return
+    path = write_temp_video(video_file)
+    try:
+        yield path
+    finally:
+        remove_files(path)
+
+def derived_path(input_path, suffix):
+    """Temp output path next to input_path, e.g. suffix '_annotated' -> <name>_annotated.mp4"""
+    return f"{os.path.splitext(input_path)[0]}{suffix}.mp4"
+
+def remove_files(*paths):
+    for path in paths:
+        try:
+            if path and os.path.exists(path):
+                os.unlink(path)
+        except OSError:
+            pass
+
+def probe_video(path):
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            raise ValueError("Cannot open video file")
+        return {
+            'fps': int(cap.get(cv2.CAP_PROP_FPS)),
+            'total_frames': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        }
+    finally:
+        cap.release()
+
+def open_video_writer(path, fps, width, height):
+    """First VideoWriter that opens among the supported codecs"""
+    for codec in FOURCC_OPTIONS:
+        out = None
+        try:
+            out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+            if out.isOpened():
+                return out
+            out.release()
+        except Exception:
+            if out is not None:
+                out.release()
+    raise Exception("Cannot create video writer")
+
+def plan_segments(total_frames, processes, min_segment_frames):
+    """Split [0, total_frames) into up to processes contiguous (start, end) ranges.
+
+    The reported frame count can be wrong, so the last range ends at None (read to
+    EOF). Returns a single range when the video is too short to split or its frame
+    count is unknown.
+    """
+    count = max(1, min(processes, max(0, total_frames) // max(1, min_segment_frames)))
+    bounds = [total_frames * i // count for i in range(count)] + [None]
+    return [(bounds[i], bounds[i + 1]) for i in range(count)]
+
+def stitch_segments(segment_paths, output_path, fps, width, height):
+    """Concatenate annotated segment files, with ffmpeg stream copy when available"""
+    paths = [p for p in segment_paths if os.path.exists(p) and os.path.getsize(p) > 0]
+    if len(paths) == 1:
+        shutil.move(paths[0], output_path)
+        return
+
+    if paths and shutil.which('ffmpeg'):
+        list_path = f"{output_path}.txt"
+        with open(list_path, 'w') as f:
+            for path in paths:
+                f.write(f"file '{path}'\n")
+        try:
+            completed = subprocess.run(
+                ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                 '-i', list_path, '-c', 'copy', output_path],
+                capture_output=True, text=True
+            )
+        finally:
+            remove_files(list_path)
+        if completed.returncode == 0:
+            return
+        print(f"ffmpeg 拼接视频失败, 改用 OpenCV 拼接: {completed.stderr.strip()}")
+
+    out = open_video_writer(output_path, fps, width, height)
+    try:
+        for path in paths:
+            cap = cv2.VideoCapture(path)
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                out.write(frame)
+            cap.release()
+    finally:
+        out.release()
+
+def _merge_counts(target, counts):
+    for key, value in counts.items():
+        target[key] = target.get(key, 0) + value
+
+def merge_segment_runs(runs):
+    """Combine VideoEngine results of consecutive segments into one"""
+    merged = {
+        'results': FrameResultBuffer.concat([run['results'] for run in runs]),
+        'processed_frames': sum(run['processed_frames'] for run in runs),
+        'written_frames': sum(run['written_frames'] for run in runs),
+        'segments': len(runs)
+    }
+
+    selection = {}
+    for run in runs:
+        stats = run.get('keyframe_selection', {})
+        for key, value in stats.items():
+            if isinstance(value, int):
+                selection[key] = selection.get(key, 0) + value
+            elif key not in selection:
+                selection[key] = value
+    if selection.get('analyzed_frames'):
+        selection['keyframe_ratio'] = round(selection.get('keyframes', 0) / selection['analyzed_frames'], 4)
+    merged['keyframe_selection'] = selection
+
+    # Tracks are per segment, so an object crossing a boundary is counted once per segment
+    if runs and all('tracking' in run for run in runs):
+        tracking = {'detected_classes': {}}
+        for run in runs:
+            for key, value in run['tracking'].items():
+                if key == 'detected_classes':
+                    _merge_counts(tracking['detected_classes'], value)
+                else:
+                    tracking[key] = tracking.get(key, 0) + value
+        merged['tracking'] = tracking
+
+    return merged
+
+def store_frame_results(results, artifacts, sidecar_format=None):
+    """Write the per-frame results as a compressed sidecar artifact and return its URL"""
+    sidecar_format = sidecar_format or VIDEO_RESULTS_CONFIG['sidecar_format']
+    extension = SIDECAR_EXTENSIONS[sidecar_format]
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{extension}') as temp_file:
+        path = temp_file.name
+    try:
+        results.write_sidecar(path, sidecar_format)
+        return artifacts.put_file(path, extension)
+    finally:
+        remove_files(path)
+
+def build_video_result(info, runs, output_path, frame_interval, start_time, artifacts=None):
+    """Response dict for an annotated video from its segment runs and output file.
+
+    Only the summary is returned inline; per-frame boxes go to a sidecar
+    artifact (frame_results_url), or inline as columns when there is no store.
+    """
+    video_run = merge_segment_runs(runs)
+    fps = info['fps']
+    total_frames = info['total_frames']
+    duration = total_frames / fps if fps > 0 else 0
+    results = video_run['results']
+    summary = results.summary()
+    processed_frames = video_run['processed_frames']
+
+    final_size_mb = os.path.getsize(output_path) / (1024 * 1024)
+
+    if artifacts is not None:
+        annotated_video = artifacts.put_file(output_path, 'mp4')
+    else:
+        with open(output_path, 'rb') as f:
+            annotated_video_base64 = base64.b64encode(f.read()).decode('utf-8')
+        annotated_video = f"data:video/mp4;base64,{annotated_video_base64}"
+
+    keyframe_detections = summary['keyframe_detections']
+    avg_detections_per_frame = keyframe_detections / summary['keyframes'] if summary['keyframes'] else 0
+    total_detections = keyframe_detections
+    all_classes = summary['detected_classes']
+    defect_objects = summary['defect_objects']
+    normal_objects = summary['normal_objects']
+
+    # With tracking, count each physical object once instead of once per keyframe
+    tracking = video_run.get('tracking')
+    if tracking is not None:
+        total_detections = tracking['unique_objects']
+        all_classes = tracking['detected_classes']
+        defect_objects = tracking['defect_objects']
+        normal_objects = tracking['normal_objects']
+
+    processing_time = (time.time() - start_time) * 1000
+
+    result = {
+        'video_info': {
+            'duration_seconds': duration,
+            'total_frames': total_frames,
+            'fps': fps,
+            'resolution': f"{info['width']}x{info['height']}",
+            'processed_frames': processed_frames,
+            'frame_interval': frame_interval,
+            'keyframes_only': True,
+            'keyframe_selection': video_run['keyframe_selection'],
+            'segments': video_run['segments'],
+            'file_size_mb': round(final_size_mb, 3)
+        },
+        'detection_summary': {
+            'total_detections': total_detections,
+            'keyframe_detections': keyframe_detections,
+            'unique_objects_tracked': tracking is not None,
+            'avg_detections_per_frame': round(avg_detections_per_frame, 2),
+            'detected_classes': all_classes,
+            'defect_objects': defect_objects,
+            'normal_objects': normal_objects
+        },
+        'processing_time_ms': processing_time,
+        'detected_objects': total_detections,
+        'performance_stats': {
+            'avg_keyframe_time_ms': processing_time / processed_frames if processed_frames > 0 else 0,
+            'total_inference_time_ms': summary['total_inference_time_ms'],
+            'optimization_enabled': True
+        },
+        'annotated_video': annotated_video
+    }
+
+    if artifacts is not None:
+        result['frame_results_url'] = store_frame_results(results, artifacts)
+        result['frame_results_format'] = VIDEO_RESULTS_CONFIG['sidecar_format']
+    else:
+        result['frame_results'] = results.to_columns()
+    return result
@@ -0,0 +1,186 @@
+import gzip
+import json
+import numpy as np
+from app.services.postprocess import CLASS_MAPPING, CLASS_NAMES_EN
+
+# Per-frame video results
+# sidecar_format: 'npz' (compressed NumPy arrays) or 'jsonl' (gzip, one line per keyframe)
+VIDEO_RESULTS_CONFIG = {
+    'sidecar_format': 'npz',
+    'initial_capacity': 1024
+}
+
+SIDECAR_EXTENSIONS = {'npz': 'npz', 'jsonl': 'gz'}
+
+FRAME_COLUMNS = {
+    'frame_number': np.int32,
+    'timestamp': np.float32,
+    'detected_objects': np.int32,
+    'classified_objects': np.int32,
+    'inference_time_ms': np.float32
+}
+
+BOX_COLUMNS = {
+    'frame_number': np.int32,
+    'x1': np.float32,
+    'y1': np.float32,
+    'x2': np.float32,
+    'y2': np.float32,
+    'class_id': np.int16,
+    'confidence': np.float32,
+    'subconfidence': np.float32,
+    'defect': np.bool_,
+    'track_id': np.int32
+}
+
+class ColumnBuffer:
+    """Growable set of same-length NumPy columns with amortized O(1) appends"""
+    def __init__(self, dtypes, capacity=1024):
+        self.dtypes = dtypes
+        self.size = 0
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+
+    def _reserve(self, extra):
+        capacity = len(next(iter(self.columns.values())))
+        if self.size + extra <= capacity:
+            return
+        capacity = max(capacity * 2, self.size + extra)
+        for name, column in self.columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def append(self, count, **values):
+        """Append count rows; each value is a scalar or an array of length count"""
+        self._reserve(count)
+        for name, column in self.columns.items():
+            column[self.size:self.size + count] = values[name]
+        self.size += count
+
+    def view(self):
+        return {name: column[:self.size] for name, column in self.columns.items()}
+
+    @classmethod
+    def concat(cls, buffers, dtypes):
+        merged = cls(dtypes, capacity=max(1, sum(b.size for b in buffers)))
+        for buffer in buffers:
+            if buffer.size:
+                merged.append(buffer.size, **buffer.view())
+        return merged
+
+class FrameResultBuffer:
+    """Columnar keyframe and box results for one video, with running summary counters.
+
+    Keyframes and boxes are stored as flat arrays instead of per-frame result
+    dicts; the summary is updated on every append so no pass over the results
+    is needed at the end.
+    """
+    def __init__(self, capacity=1024):
+        self.frames = ColumnBuffer(FRAME_COLUMNS, capacity)
+        self.boxes = ColumnBuffer(BOX_COLUMNS, capacity)
+        self.class_counts = np.zeros(len(CLASS_MAPPING), dtype=np.int64)
+        self.unknown_classes = {}
+        self.defect_count = 0
+        self.total_inference_ms = 0.0
+
+    def add_keyframe(self, frame_number, timestamp, detections, sub_results, inference_time_ms,
+                     classified_objects=None):
+        count = len(detections)
+        self.frames.append(
+            1,
+            frame_number=frame_number,
+            timestamp=timestamp,
+            detected_objects=count,
+            classified_objects=count if classified_objects is None else classified_objects,
+            inference_time_ms=inference_time_ms
+        )
+        self.total_inference_ms += inference_time_ms
+        if count == 0:
+            return
+
+        defect = np.array([r.get('defect_status') == '缺陷' for r in sub_results], dtype=bool)
+        self.boxes.append(
+            count,
+            frame_number=frame_number,
+            x1=detections.xyxy[:, 0],
+            y1=detections.xyxy[:, 1],
+            x2=detections.xyxy[:, 2],
+            y2=detections.xyxy[:, 3],
+            class_id=detections.cls,
+            confidence=detections.conf,
+            subconfidence=[r.get('subconfidence', 0.0) for r in sub_results],
+            defect=defect,
+            track_id=[r.get('track_id', -1) for r in sub_results]
+        )
+        self._count(detections.cls, defect)
+
+    def _count(self, cls, defect):
+        known = (cls >= 0) & (cls < len(self.class_counts))
+        self.class_counts += np.bincount(cls[known], minlength=len(self.class_counts))
+        for class_id in cls[~known].tolist():
+            self.unknown_classes[class_id] = self.unknown_classes.get(class_id, 0) + 1
+        self.defect_count += int(defect.sum())
+
+    @classmethod
+    def concat(cls, buffers):
+        merged = cls(capacity=1)
+        merged.frames = ColumnBuffer.concat([b.frames for b in buffers], FRAME_COLUMNS)
+        merged.boxes = ColumnBuffer.concat([b.boxes for b in buffers], BOX_COLUMNS)
+        for buffer in buffers:
+            merged.class_counts += buffer.class_counts
+            for class_id, count in buffer.unknown_classes.items():
+                merged.unknown_classes[class_id] = merged.unknown_classes.get(class_id, 0) + count
+            merged.defect_count += buffer.defect_count
+            merged.total_inference_ms += buffer.total_inference_ms
+        return merged
+
+    def summary(self):
+        detected_classes = {
+            CLASS_NAMES_EN[i]: int(count) for i, count in enumerate(self.class_counts.tolist()) if count
+        }
+        for class_id, count in self.unknown_classes.items():
+            detected_classes[f"unknown_class_{class_id}"] = count
+        return {
+            'keyframes': self.frames.size,
+            'keyframe_detections': self.boxes.size,
+            'detected_classes': detected_classes,
+            'defect_objects': self.defect_count,
+            'normal_objects': self.boxes.size - self.defect_count,
+            'total_inference_time_ms': self.total_inference_ms
+        }
+
+    def to_columns(self):
+        """JSON-ready column lists"""
+        return {
+            'frames': {name: column.tolist() for name, column in self.frames.view().items()},
+            'boxes': {name: column.tolist() for name, column in self.boxes.view().items()},
+            'class_names': CLASS_NAMES_EN.tolist()
+        }
+
+    def write_npz(self, path):
+        frames = {f"frame_{name}": column for name, column in self.frames.view().items()}
+        boxes = {f"box_{name}": column for name, column in self.boxes.view().items()}
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, class_names=CLASS_NAMES_EN.astype(str), **frames, **boxes)
+
+    def write_jsonl(self, path):
+        frames = self.frames.view()
+        boxes = self.boxes.view()
+        # Boxes are appended in frame order, so each keyframe owns a contiguous slice
+        starts = np.searchsorted(boxes['frame_number'], frames['frame_number'], side='left')
+        ends = np.searchsorted(boxes['frame_number'], frames['frame_number'], side='right')
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            for i in range(self.frames.size):
+                rows = slice(starts[i], ends[i])
+                line = {name: column[i].item() for name, column in frames.items()}
+                line['boxes'] = np.stack([boxes['x1'][rows], boxes['y1'][rows],
+                                          boxes['x2'][rows], boxes['y2'][rows]], axis=1).round(1).tolist()
+                for name in ('class_id', 'confidence', 'subconfidence', 'defect', 'track_id'):
+                    line[name] = boxes[name][rows].tolist()
+                f.write(json.dumps(line, ensure_ascii=False) + '\n')
+
+    def write_sidecar(self, path, sidecar_format='npz'):
+        if sidecar_format == 'jsonl':
+            self.write_jsonl(path)
+        else:
+            self.write_npz(path)
@@ -0,0 +1,212 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty
+import torch
+
+# Multi-process inference
+# processes: number of forked inference processes; None sizes the pool from the CPU
+#            count (cpu_count // threads_per_process, in-process below 2), 0 runs everything in-process
+# max_pending: requests allowed in flight before submit() blocks (backpressure)
+WORKER_POOL_CONFIG = {
+    'processes': None,
+    'threads_per_process': 1,
+    'pin_cpus': True,
+    'max_pending': 64,
+    'submit_timeout_s': 30
+}
+
+# Model worker inherited by forked processes; set in the parent before forking
+_pool_worker = None
+
+def _init_process(threads, pin_cpus, process_counter):
+    torch.set_num_threads(threads)
+
+    if pin_cpus and hasattr(os, 'sched_setaffinity'):
+        with process_counter.get_lock():
+            index = process_counter.value
+            process_counter.value += 1
+        cpus = sorted(os.sched_getaffinity(0))
+        assigned = cpus[index * threads:(index + 1) * threads]
+        if len(assigned) == threads:
+            os.sched_setaffinity(0, assigned)
+
+def _call_worker(method, args, kwargs):
+    return getattr(_pool_worker, method)(*args, **kwargs)
+
+def _run_video(video_file, frame_interval, keyframe_mode, cancel_event, progress_queue):
+    last_percent = [-1]
+
+    def progress_callback(current_frame, total_frames):
+        percent = int(current_frame * 100 / total_frames) if total_frames > 0 else 0
+        if percent != last_percent[0]:
+            last_percent[0] = percent
+            progress_queue.put((current_frame, total_frames))
+
+    return _pool_worker.process_video_with_annotation(
+        video_file, frame_interval,
+        task_checker=cancel_event.is_set,
+        progress_callback=progress_callback,
+        keyframe_mode=keyframe_mode
+    )
+
+def _run_video_segment(segment_index, input_path, output_path, start_frame, end_frame, frame_interval,
+                       keyframe_mode, cancel_event, progress_queue):
+    last_percent = [-1]
+
+    def progress_callback(current_frame, total_frames):
+        percent = int(current_frame * 100 / total_frames) if total_frames > 0 else 0
+        if percent != last_percent[0]:
+            last_percent[0] = percent
+            progress_queue.put((segment_index, current_frame))
+
+    return _pool_worker.process_video_segment(
+        input_path, output_path, start_frame, end_frame, frame_interval,
+        task_checker=cancel_event.is_set,
+        progress_callback=progress_callback,
+        keyframe_mode=keyframe_mode
+    )
+
+class InferencePool:
+    """Forked inference processes sharing the parent's model weights copy-on-write.
+
+    submit() blocks once max_pending requests are in flight and raises after
+    submit_timeout_s, so overload turns into errors instead of unbounded queues.
+    """
+    def __init__(self, model_worker, processes, threads_per_process=1, pin_cpus=True,
+                 max_pending=64, submit_timeout_s=30):
+        global _pool_worker
+        _pool_worker = model_worker
+
+        ctx = multiprocessing.get_context('fork')
+        self.processes = processes
+        self.submit_timeout = submit_timeout_s
+        self.slots = threading.BoundedSemaphore(max_pending)
+        # The Manager process is forked too: start it before the Pool's handler threads
+        # and the scheduler/encode/request threads exist
+        self.manager = ctx.Manager()
+        self.pool = ctx.Pool(
+            processes=processes,
+            initializer=_init_process,
+            initargs=(threads_per_process, pin_cpus, ctx.Value('i', 0))
+        )
+        print(f"推理进程池已启动: {processes} 个进程, 每进程 {threads_per_process} 线程")
+
+    def _acquire_slot(self):
+        if not self.slots.acquire(timeout=self.submit_timeout):
+            raise RuntimeError("推理服务繁忙，请稍后重试")
+
+    def _apply(self, func, args):
+        self._acquire_slot()
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def on_result(result):
+            self.slots.release()
+            future.set_result(result)
+
+        def on_error(error):
+            self.slots.release()
+            future.set_exception(error)
+
+        try:
+            self.pool.apply_async(func, args, callback=on_result, error_callback=on_error)
+        except Exception:
+            self.slots.release()
+            raise
+        return future
+
+    def submit(self, method, *args, **kwargs):
+        """Run ImageRecognitionWorker.<method>(*args, **kwargs) in a pool process"""
+        return self._apply(_call_worker, (method, args, kwargs))
+
+    def process_video(self, video_file, frame_interval, task_checker=None, progress_callback=None, keyframe_mode=None):
+        """Process a video in a pool process, relaying progress and cancellation"""
+        cancel_event = self.manager.Event()
+        progress_queue = self.manager.Queue()
+        future = self._apply(_run_video, (video_file, frame_interval, keyframe_mode, cancel_event, progress_queue))
+
+        def relay_progress(timeout):
+            try:
+                current_frame, total_frames = progress_queue.get(timeout=timeout)
+            except Empty:
+                return
+            if progress_callback:
+                progress_callback(current_frame, total_frames)
+
+        while not future.done():
+            relay_progress(0.2)
+            if task_checker and not cancel_event.is_set() and task_checker():
+                cancel_event.set()
+
+        while not progress_queue.empty():
+            relay_progress(0)
+
+        return future.result()
+
+    def process_video_segments(self, input_path, segments, output_paths, frame_interval, total_frames,
+                               keyframe_mode=None, task_checker=None, progress_callback=None):
+        """Process (start, end) frame ranges of one video in parallel pool processes.
+
+        An end of None reads to EOF. Progress is reported as frames done over
+        total_frames; returns one VideoEngine result per segment, in segment order.
+        """
+        cancel_event = self.manager.Event()
+        progress_queue = self.manager.Queue()
+        futures = [
+            self._apply(_run_video_segment, (i, input_path, output_paths[i], start, end, frame_interval,
+                                             keyframe_mode, cancel_event, progress_queue))
+            for i, (start, end) in enumerate(segments)
+        ]
+        done_frames = [0] * len(segments)
+
+        def relay_progress(timeout):
+            try:
+                segment_index, current_frame = progress_queue.get(timeout=timeout)
+            except Empty:
+                return
+            done_frames[segment_index] = current_frame
+            if progress_callback:
+                progress_callback(min(sum(done_frames), total_frames), total_frames)
+
+        while not all(future.done() for future in futures):
+            relay_progress(0.2)
+            if task_checker and not cancel_event.is_set() and task_checker():
+                cancel_event.set()
+
+        while not progress_queue.empty():
+            relay_progress(0)
+
+        return [future.result() for future in futures]
+
+def pool_size(config):
+    """Configured process count, or one process per threads_per_process CPUs when None"""
+    if config['processes'] is not None:
+        return config['processes']
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    processes = cpus // max(1, config['threads_per_process'])
+    return processes if processes >= 2 else 0
+
+def create_pool(model_worker, config=None):
+    """Build an InferencePool from config, or None when disabled/unsupported"""
+    config = config or WORKER_POOL_CONFIG
+    processes = pool_size(config)
+    if processes <= 0:
+        return None
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        print("当前平台不支持 fork, 推理进程池已禁用")
+        return None
+
+    pool_start = time.time()
+    pool = InferencePool(
+        model_worker,
+        processes=processes,
+        threads_per_process=config['threads_per_process'],
+        pin_cpus=config['pin_cpus'],
+        max_pending=config['max_pending'],
+        submit_timeout_s=config['submit_timeout_s']
+    )
+    print(f"推理进程池初始化完成: {time.time() - pool_start:.2f}s")
+    return pool
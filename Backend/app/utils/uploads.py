@@ -0,0 +1,71 @@
+import hashlib
+import os
+import tempfile
+from flask import Request
+from app.utils.common import is_video_file
+
+# Upload spooling
+# spool_dir: directory for spooled video uploads, None uses the system temp dir
+UPLOAD_CONFIG = {
+    'spool_dir': None,
+    'hash_algorithm': 'sha256'
+}
+
+class SpooledUpload:
+    """File part of a multipart upload written straight to disk as it is parsed.
+
+    The hash and size are updated on every write, so neither needs another pass
+    over the file. Other file methods (read, seek, close...) go to the temp file.
+    """
+    def __init__(self, suffix='', spool_dir=None, hash_algorithm='sha256'):
+        self.file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=spool_dir)
+        self.path = self.file.name
+        self.size = 0
+        self.hash = hashlib.new(hash_algorithm)
+        self.retained = False
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+    def retain(self):
+        """Keep the file after the request ends and return its path; the caller deletes it"""
+        self.retained = True
+        self.file.close()
+        return self.path
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+class StreamingRequest(Request):
+    """Request that spools video file parts to disk instead of memory.
+
+    Spooled files not retained by the view are deleted when the request closes.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if filename and is_video_file(filename):
+            upload = SpooledUpload(
+                suffix=os.path.splitext(filename)[1].lower(),
+                spool_dir=UPLOAD_CONFIG['spool_dir'],
+                hash_algorithm=UPLOAD_CONFIG['hash_algorithm']
+            )
+            self.__dict__.setdefault('spooled_uploads', []).append(upload)
+            return upload
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+    def close(self):
+        super().close()
+        for upload in self.__dict__.get('spooled_uploads', []):
+            if not upload.retained:
+                discard_upload(upload.path)
+
+def discard_upload(path):
+    try:
+        if path and os.path.exists(path):
+            os.unlink(path)
+    except OSError:
+        pass
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+导出检测模型和缺陷分类模型到 ONNX / OpenVINO 推理后端
+"""
+import argparse
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+
+from app.services import model_backend
+
+def export_all(fmt, export_dir, force=False):
+    for weights in (model_backend.BACKEND_CONFIG['detector_weights'],
+                    model_backend.BACKEND_CONFIG['classifier_weights']):
+        if not force and model_backend.find_export(weights, fmt, export_dir):
+            print(f"已是最新, 跳过: {weights}")
+            continue
+        entry = model_backend.export_model(weights, fmt, export_dir)
+        print(f"- {entry['path']} (task={entry['task']}, imgsz={entry['imgsz']})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出推理后端模型")
+    parser.add_argument('--format', default='onnx', choices=sorted(model_backend.EXPORT_FORMATS))
+    parser.add_argument('--export-dir', default=model_backend.BACKEND_CONFIG['export_dir'])
+    parser.add_argument('--force', action='store_true', help='忽略已有导出, 重新导出')
+    args = parser.parse_args()
+
+    try:
+        export_all(args.format, args.export_dir, args.force)
+    except ImportError as e:
+        print(f"缺少依赖: {e}")
+        print("pip install onnx onnxruntime" if args.format == 'onnx' else "pip install openvino")
+    except Exception as e:
+        print(f"导出模型失败: {e}")
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+INT8 量化检测模型和缺陷分类模型, 并生成与 FP32 模型的精度对比报告
+"""
+import argparse
+import json
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+
+from app.services import model_backend
+from app.services.quantization import list_images, parity_report
+from app.services.recognition_worker import ImageRecognitionWorker
+
+def quantize_and_compare(mode, calibration_dir, parity_dir, samples, iou_threshold):
+    model_backend.BACKEND_CONFIG['calibration_dir'] = calibration_dir
+    model_backend.BACKEND_CONFIG['calibration_samples'] = samples
+
+    for weights in (model_backend.BACKEND_CONFIG['detector_weights'],
+                    model_backend.BACKEND_CONFIG['classifier_weights']):
+        entry = model_backend.quantize_model(weights, mode)
+        print(f"- {entry['path']}")
+
+    # 独立的 FP32 基准, 不导入 image_service (避免启动进程池、调度线程和结果缓存)
+    reference = ImageRecognitionWorker(backend='pytorch')
+    candidate = ImageRecognitionWorker(backend='onnx', quantization=mode)
+
+    if candidate.model1_backend != f'onnx-int8-{mode}' or candidate.model2_backend != f'onnx-int8-{mode}':
+        raise RuntimeError("量化模型加载失败, 已回退到 PyTorch")
+
+    return parity_report(reference, candidate, list_images(parity_dir), iou_threshold)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="INT8 量化并输出精度对比报告")
+    parser.add_argument('--mode', default='dynamic', choices=['dynamic', 'static'])
+    parser.add_argument('--calibration-dir', default=model_backend.BACKEND_CONFIG['calibration_dir'])
+    parser.add_argument('--parity-dir', default=None, help='对比用图片目录, 默认与校准目录相同')
+    parser.add_argument('--samples', type=int, default=model_backend.BACKEND_CONFIG['calibration_samples'])
+    parser.add_argument('--iou', type=float, default=0.5, help='框匹配 IoU 阈值')
+    parser.add_argument('--output', default=None, help='报告 JSON 输出路径')
+    args = parser.parse_args()
+
+    try:
+        report = quantize_and_compare(args.mode, args.calibration_dir,
+                                      args.parity_dir or args.calibration_dir,
+                                      args.samples, args.iou)
+        print(json.dumps(report['summary'], indent=2, ensure_ascii=False))
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            print(f"报告已写入: {args.output}")
+    except ImportError as e:
+        print(f"缺少依赖: {e}")
+        print("pip install onnx onnxruntime")
+    except Exception as e:
+        print(f"量化失败: {e}")
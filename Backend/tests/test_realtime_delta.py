@@ -0,0 +1,61 @@
+from app.services.realtime import DELTA_FIELDS, DeltaEncoder, pack_rows
+
+def prediction(x, confidence=0.9, defect_status='正常', class_id=1):
+    return {
+        'center': {'x': x, 'y': 0.5},
+        'width': 0.1,
+        'height': 0.1,
+        'confidence': confidence,
+        'defect_status': defect_status,
+        'class_id': class_id
+    }
+
+def tracked(*items):
+    return {
+        'predictions': [prediction(x, **kwargs) for _, x, kwargs in items],
+        'track_ids': [track_id for track_id, _, _ in items]
+    }
+
+def test_pack_rows():
+    rows = pack_rows(tracked((7, 0.25, {'defect_status': '缺陷'})))
+    assert rows == [[7, 2500, 5000, 1000, 1000, 900, 1, 1]]
+    assert len(rows[0]) == len(DELTA_FIELDS)
+
+def test_first_response_is_a_keyframe():
+    message = DeltaEncoder().encode(tracked((1, 0.1, {}), (2, 0.2, {})))
+    assert message['keyframe'] is True
+    assert message['seq'] == 1
+    assert [row[0] for row in message['objects']] == [1, 2]
+    assert message['fields'] == DELTA_FIELDS
+
+def test_delta_lists_added_updated_and_removed():
+    encoder = DeltaEncoder(keyframe_interval=30)
+    encoder.encode(tracked((1, 0.1, {}), (2, 0.2, {}), (3, 0.3, {})))
+    message = encoder.encode(tracked((1, 0.1001, {}), (3, 0.3, {'defect_status': '缺陷'}), (4, 0.4, {})))
+
+    assert message['keyframe'] is False
+    assert message['base_seq'] == 1 and message['seq'] == 2
+    assert [row[0] for row in message['added']] == [4]
+    # Track 1 moved less than the tolerance, track 3 changed its defect status
+    assert [row[0] for row in message['updated']] == [3]
+    assert message['removed'] == [2]
+
+def test_small_moves_accumulate_against_the_last_sent_box():
+    encoder = DeltaEncoder(box_tolerance=0.002)
+    encoder.encode(tracked((1, 0.1, {})))
+    assert encoder.encode(tracked((1, 0.1015, {})))['updated'] == []
+    assert [row[0] for row in encoder.encode(tracked((1, 0.103, {})))['updated']] == [1]
+
+def test_periodic_keyframe_and_resync():
+    encoder = DeltaEncoder(keyframe_interval=3)
+    frames = [encoder.encode(tracked((1, 0.1, {})))['keyframe'] for _ in range(4)]
+    assert frames == [True, False, False, True]
+    assert encoder.encode(tracked((1, 0.1, {})), resync=True)['keyframe'] is True
+
+def test_untracked_results_are_always_keyframes():
+    encoder = DeltaEncoder()
+    result = {'predictions': [prediction(0.1)]}
+    assert encoder.encode(result)['keyframe'] is True
+    message = encoder.encode(result)
+    assert message['keyframe'] is True
+    assert message['objects'][0][0] == 1
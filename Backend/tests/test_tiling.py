@@ -0,0 +1,38 @@
+import numpy as np
+from app.services.tiling import merge_detections, tile_grid
+
+def merge(boxes, conf, cls, **kwargs):
+    return merge_detections(np.array(boxes, dtype=np.float32).reshape(-1, 4),
+                            np.array(conf, dtype=np.float32), np.array(cls, dtype=int), **kwargs)
+
+def test_overlapping_duplicates_merge_into_union():
+    xyxy, conf, cls = merge([[0, 0, 100, 100], [10, 0, 110, 100]], [0.6, 0.9], [0, 0])
+    np.testing.assert_allclose(xyxy, [[0, 0, 110, 100]])
+    np.testing.assert_allclose(conf, [0.9])
+    assert cls.tolist() == [0]
+
+def test_box_cut_by_tile_edge_merges_by_ios():
+    # IoU is only 0.4, but the smaller box lies entirely inside the larger one
+    xyxy, conf, _ = merge([[0, 0, 100, 100], [0, 0, 40, 100]], [0.9, 0.8], [1, 1])
+    np.testing.assert_allclose(xyxy, [[0, 0, 100, 100]])
+    np.testing.assert_allclose(conf, [0.9])
+
+def test_different_classes_are_kept():
+    xyxy, _, cls = merge([[0, 0, 100, 100], [0, 0, 100, 100]], [0.9, 0.8], [0, 1])
+    assert len(xyxy) == 2
+    assert sorted(cls.tolist()) == [0, 1]
+
+def test_separate_boxes_are_kept_in_confidence_order():
+    xyxy, conf, _ = merge([[0, 0, 10, 10], [50, 50, 60, 60]], [0.5, 0.7], [0, 0])
+    np.testing.assert_allclose(conf, [0.7, 0.5])
+    np.testing.assert_allclose(xyxy, [[50, 50, 60, 60], [0, 0, 10, 10]])
+
+def test_empty_input():
+    xyxy, conf, cls = merge([], [], [])
+    assert len(xyxy) == len(conf) == len(cls) == 0
+
+def test_tile_grid_covers_the_image():
+    tiles = tile_grid(2500, 1000, 1024, 0.2)
+    assert all(w == 1024 and h == 1000 for _, _, w, h in tiles)
+    assert tiles[0][0] == 0 and tiles[-1][0] + 1024 == 2500
+    assert tile_grid(500, 400, 1024, 0.2) == [(0, 0, 500, 400)]
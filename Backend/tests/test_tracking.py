@@ -0,0 +1,71 @@
+import numpy as np
+from app.services.postprocess import Detections
+from app.services.tracking import IoUTracker, iou_matrix
+
+def detections(boxes, cls=None, width=1000, height=1000):
+    cls = [0] * len(boxes) if cls is None else cls
+    return Detections(np.array(boxes, dtype=np.float32).reshape(-1, 4), [0.9] * len(boxes), cls, width, height)
+
+def test_iou_matrix():
+    a = np.array([[0, 0, 10, 10]], dtype=np.float32)
+    b = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]], dtype=np.float32)
+    np.testing.assert_allclose(iou_matrix(a, b), [[1.0, 1 / 3, 0.0]], rtol=1e-5)
+    assert iou_matrix(a, b[:0]).shape == (1, 0)
+
+def test_moving_object_keeps_its_id():
+    tracker = IoUTracker(classify_refresh=0)
+    tracks, to_classify = tracker.update(detections([[100, 100, 200, 200]]), 0)
+    assert to_classify == [0]
+    first_id = tracks[0].id
+
+    tracks, to_classify = tracker.update(detections([[110, 100, 210, 200], [600, 600, 700, 700]]), 1)
+    assert tracks[0].id == first_id
+    assert tracks[1].id != first_id
+    # Only the new object needs the classifier
+    assert to_classify == [1]
+
+def test_class_mismatch_starts_a_new_track():
+    tracker = IoUTracker()
+    first, _ = tracker.update(detections([[100, 100, 200, 200]], cls=[0]), 0)
+    second, _ = tracker.update(detections([[100, 100, 200, 200]], cls=[1]), 1)
+    assert second[0].id != first[0].id
+
+def test_track_ends_after_max_missed():
+    tracker = IoUTracker(max_missed=1)
+    tracker.update(detections([[100, 100, 200, 200]]), 0)
+    tracker.update(detections([]), 1)
+    assert len(tracker.tracks) == 1
+    tracker.update(detections([]), 2)
+    assert tracker.tracks == []
+    assert len(tracker.finished) == 1
+
+def test_keep_finished_false_drops_ended_tracks():
+    tracker = IoUTracker(max_missed=0, keep_finished=False)
+    tracker.update(detections([[100, 100, 200, 200]]), 0)
+    tracker.update(detections([]), 1)
+    assert tracker.tracks == [] and tracker.finished == []
+
+def test_classify_refresh_and_reclassify_iou():
+    tracker = IoUTracker(classify_refresh=3, reclassify_iou=0.9, alpha=1.0, beta=0.0)
+    _, to_classify = tracker.update(detections([[100, 100, 200, 200]]), 0)
+    assert to_classify == [0]
+    _, to_classify = tracker.update(detections([[101, 100, 201, 200]]), 1)
+    assert to_classify == []
+    # Moved far enough from where it was classified
+    _, to_classify = tracker.update(detections([[130, 100, 230, 200]]), 2)
+    assert to_classify == [0]
+    for frame in (3, 4):
+        _, to_classify = tracker.update(detections([[130, 100, 230, 200]]), frame)
+        assert to_classify == []
+    _, to_classify = tracker.update(detections([[130, 100, 230, 200]]), 5)
+    assert to_classify == [0]
+
+def test_summary_counts_unique_objects():
+    tracker = IoUTracker()
+    tracks, _ = tracker.update(detections([[100, 100, 200, 200], [500, 500, 600, 600]]), 0)
+    tracks[0].set_sub_result({'defect_status': '缺陷'})
+    tracker.update(detections([[102, 100, 202, 200], [500, 502, 600, 602]]), 1)
+    summary = tracker.summary()
+    assert summary['unique_objects'] == 2
+    assert summary['defect_objects'] == 1
+    assert summary['normal_objects'] == 1
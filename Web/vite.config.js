@@ -31,6 +31,7 @@ export default defineConfig({
         target: 'https://127.0.0.1:8090', // 使用本地回环地址，避免防火墙或网络问题
         changeOrigin: true,
         secure: false, // 忽略证书验证
+        ws: true, // 转发 /api/realtime/ws 实时检测通道
         configure: (proxy, options) => {
           proxy.on('error', (err, req, res) => {
             console.log('proxy error', err);